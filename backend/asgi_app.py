@@ -0,0 +1,233 @@
+"""
+ASGI entry point for the blog API
+
+Serve it with any ASGI server, for example:
+
+    uvicorn asgi_app:app --app-dir backend --port 5002
+
+Connections, keep-alive, request bodies and response streaming are handled
+on the event loop, so idle and slow clients cost no threads. Each request is
+then answered by the same Flask views as the WSGI app (same validation, same
+error messages) on a bounded thread pool. The event stream is the exception:
+its subscribers wait on the event loop, so thousands of them cost no threads.
+"""
+import asyncio
+import io
+import os
+import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import backend_app
+import event_stream
+from async_store import AsyncPostStore
+from event_stream import CONTENT_TYPE as EVENT_STREAM_CONTENT_TYPE, HEARTBEAT, EventStreamFull, LoopWaker
+
+# Threads answering requests; idle connections don't use one
+DEFAULT_THREADS = 32
+# Response chunks buffered per request before the worker thread waits for the client
+RESPONSE_BUFFER_CHUNKS = 16
+
+EVENT_STREAM_PATH = '/api/posts/stream'
+
+
+class AsgiApp:
+    """Serves a WSGI (Flask) application over ASGI"""
+
+    def __init__(self, wsgi_app, threads=DEFAULT_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-request')
+        self._wakers = weakref.WeakKeyDictionary()  # event loop -> LoopWaker
+
+    @property
+    def store(self):
+        """The app's post store, with awaitable methods"""
+        return AsyncPostStore(backend_app.POSTS, self.executor)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == EVENT_STREAM_PATH and scope['method'] == 'GET':
+                await self.stream_events(scope, receive, send)
+            else:
+                await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.store.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(RESPONSE_BUFFER_CHUNKS)
+        disconnected = False
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def run():
+            # Runs on a worker thread: call the WSGI app and hand its output to the loop
+            def start_response(status, headers, exc_info=None):
+                put(('start', int(status.split(' ', 1)[0]), headers))
+
+            try:
+                result = self.wsgi_app(build_environ(scope, bytes(body)), start_response)
+                try:
+                    for chunk in result:
+                        if disconnected:
+                            break
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            finally:
+                put(('end', None))
+
+        worker = loop.run_in_executor(self.executor, run)
+        kind = None
+        try:
+            while kind != 'end':
+                kind, *item = await chunks.get()
+                if kind == 'start':
+                    status, headers = item
+                    await send({
+                        'type': 'http.response.start',
+                        'status': status,
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in headers],
+                    })
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': item[0], 'more_body': True})
+                else:
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except Exception:
+            # Sending failed, usually because the client went away: let the
+            # worker stop at its next chunk and wait for it to finish
+            disconnected = True
+            while kind != 'end':
+                kind, *item = await chunks.get()
+            await worker
+            raise
+        await worker
+
+
+    async def stream_events(self, scope, receive, send):
+        """Serve /api/posts/stream on the event loop
+
+        Same events as the Flask view (backend_app.stream_events), but a
+        subscriber waiting for them is only a suspended coroutine.
+        """
+        loop = asyncio.get_running_loop()
+        waker = self._wakers.get(loop)
+        if waker is None:
+            waker = self._wakers[loop] = LoopWaker(loop)
+        events = backend_app.EVENTS
+        ready = asyncio.Event()
+        try:
+            subscription = events.subscribe(lambda: waker.wake(ready))
+        except EventStreamFull as error:
+            body = backend_app.app.json.encode({"error": str(error)})
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            headers = dict(scope['headers'])
+            last_event_id = headers.get(b'last-event-id', b'').decode('latin-1')
+            if not last_event_id:
+                last_event_id = parse_qs(scope['query_string'].decode('latin-1')).get('since', [''])[0]
+            # Reading the change log may touch the store, so it runs on the thread pool
+            preamble = await loop.run_in_executor(
+                self.executor, backend_app.event_stream_preamble, subscription, last_event_id)
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', EVENT_STREAM_CONTENT_TYPE.encode('latin-1')),
+                            (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'),
+                            (b'access-control-allow-origin', b'*')],
+            })
+            await send({'type': 'http.response.body', 'body': preamble, 'more_body': True})
+            while not subscription.evicted:
+                woken = asyncio.ensure_future(ready.wait())
+                done, _ = await asyncio.wait({woken, disconnected}, timeout=event_stream.HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if woken not in done:
+                    woken.cancel()
+                    if disconnected in done:
+                        return
+                    await send({'type': 'http.response.body', 'body': HEARTBEAT, 'more_body': True})
+                    continue
+                ready.clear()
+                chunk = b''.join(subscription.drain())
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            # Evicted for falling behind: end the stream so the client reconnects and resumes
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+            events.unsubscribe(subscription)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP request"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope['headers']:
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+app = AsgiApp(backend_app.app, threads=int(os.environ.get('BLOG_ASGI_THREADS', DEFAULT_THREADS)))
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5002)
@@ -0,0 +1,42 @@
+"""
+Awaitable access to a post store for async code
+"""
+import asyncio
+import functools
+
+from post_store import PostStore
+
+
+class AsyncPostStore:
+    """Wraps a BasePostStore so every method can be awaited from an event loop
+
+    Calls that may block (disk or database I/O) run on a thread pool. The
+    plain in-memory store only ever holds its lock for microseconds, so its
+    methods are called directly on the event loop.
+    """
+
+    # Methods of BasePostStore exposed as coroutines
+    METHODS = (
+        'all', 'get', 'sorted', 'page', 'search', 'search_page', 'version',
+        'create', 'add', 'update', 'delete', 'create_many', 'update_many', 'delete_many', 'close',
+    )
+
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor
+        self.blocking = type(store) is not PostStore
+
+    def __getattr__(self, name):
+        if name not in self.METHODS:
+            raise AttributeError(name)
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            if not self.blocking:
+                return method(*args, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+        return call
+
+    def __len__(self):
+        return len(self.store)
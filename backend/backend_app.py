@@ -1,24 +1,279 @@
-from flask import Flask, jsonify, request
+import functools
+import hmac
+import io
+import json
+import marshal
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import Flask, Response, abort, jsonify, make_response, request
 from flask_cors import CORS
 
+from change_log import DEFAULT_CHANGE_LOG_SIZE, ChangeLog, decode_version, encode_version
+from compression import (
+    DEFAULT_LEVELS as DEFAULT_COMPRESSION_LEVELS, DEFAULT_MIN_BYTES as DEFAULT_COMPRESSION_MIN_BYTES,
+    ResponseCompression, parse_levels)
+from event_stream import (
+    CONTENT_TYPE as EVENT_STREAM_CONTENT_TYPE, EventHub, EventStreamFull, format_event, format_preamble,
+    thread_events)
+from json_provider import DEFAULT_ENCODED_POST_BYTES, EncodedPostCache, FastJSONProvider
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Gauge, RequestMetrics, checkpoint
+from pagination import PaginationError, decode_cursor, encode_cursor, listing_scope, parse_limit
+from post import Post
+from post_store import SORT_FIELDS
+from profiling import (
+    DEFAULT_SAMPLE_INTERVAL, MAX_PROFILE_TIMEOUT, MAX_PROFILED_REQUESTS, MAX_SAMPLE_SECONDS, RequestProfiler,
+    sample_stacks)
+from response_cache import DEFAULT_CACHE_BYTES, open_cache, search_dependency
+from search_index import SEARCH_MODES
+from storage import DEFAULT_STORE_URL, open_store
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson when installed, the standard library otherwise
 CORS(app)  # This will enable CORS for all routes
 
-POSTS = [
+SEED_POSTS = [
     {"id": 1, "title": "First post", "content": "This is the first post."},
     {"id": 2, "title": "Second post", "content": "This is the second post."},
 ]
 
+# Post store chosen with the BLOG_STORE environment variable, e.g.
+# BLOG_STORE=sqlite:///blog.db (see storage.open_store)
+POSTS = open_store(os.environ.get('BLOG_STORE', DEFAULT_STORE_URL), SEED_POSTS)
+
+# Cache of serialized listing and search responses, kept current by the store.
+# BLOG_CACHE_URL=redis://... shares it between worker processes.
+RESPONSE_CACHE = open_cache(
+    os.environ.get('BLOG_CACHE_URL'), int(os.environ.get('BLOG_CACHE_BYTES', DEFAULT_CACHE_BYTES)))
+POSTS.add_listener(RESPONSE_CACHE.post_written)
+
+# Encoded JSON of each post, joined into listing bodies
+ENCODED_POSTS = EncodedPostCache(
+    app.json.encode, int(os.environ.get('BLOG_ENCODED_POST_BYTES', DEFAULT_ENCODED_POST_BYTES)))
+POSTS.add_listener(ENCODED_POSTS.post_written)
+
+# The latest writes, served by /api/posts/changes so clients can catch up
+# without reloading every post
+CHANGES = ChangeLog(POSTS.version()[1], int(os.environ.get('BLOG_CHANGE_LOG_SIZE', DEFAULT_CHANGE_LOG_SIZE)))
+POSTS.add_listener(CHANGES.post_written)
+
+# Subscribers of /api/posts/stream, sent every write as a server-sent event
+EVENTS = EventHub(POSTS.version()[0], app.json.encode)
+POSTS.add_listener(EVENTS.post_written)
+
+# Per-route latency, size and status of every request, plus store and
+# cache metrics read when /metrics is scraped
+METRICS = RequestMetrics(app)
+
+
+def lock_waits(position):
+    """Waits (position 0) or seconds waited (position 1) per mode of the store's lock"""
+    stats = POSTS.lock_wait_stats()
+    if stats is None:
+        return None
+    return [((mode,), values[position]) for mode, values in sorted(stats.items())]
+
+
+for metric in [
+    Gauge('blog_posts', "Number of stored posts", lambda: len(POSTS)),
+    Gauge('blog_store_lock_waits_total', "Store lock acquisitions that had to wait",
+          lambda: lock_waits(0), ('mode',), type='counter'),
+    Gauge('blog_store_lock_wait_seconds_total', "Time spent waiting for the store lock",
+          lambda: lock_waits(1), ('mode',), type='counter'),
+    Gauge('blog_response_cache_requests_total', "Response cache lookups",
+          lambda: [(('hit',), RESPONSE_CACHE.hits), (('miss',), RESPONSE_CACHE.misses)], ('result',), type='counter'),
+    Gauge('blog_response_cache_invalidations_total', "Cached responses dropped because of writes",
+          lambda: RESPONSE_CACHE.invalidations, type='counter'),
+    Gauge('blog_response_cache_evictions_total', "Cached responses evicted for space",
+          lambda: RESPONSE_CACHE.backend.evictions, type='counter'),
+    Gauge('blog_event_stream_subscribers', "Open /api/posts/stream connections", lambda: len(EVENTS)),
+    Gauge('blog_event_stream_evictions_total', "Event streams closed because the client fell behind",
+          lambda: EVENTS.evictions, type='counter'),
+]:
+    METRICS.registry.register(metric)
+
+# Profiling endpoints are off unless BLOG_PROFILING_TOKEN is set; requests to
+# them must then send it as "Authorization: Bearer <token>"
+PROFILING_TOKEN = os.environ.get('BLOG_PROFILING_TOKEN')
+PROFILER = RequestProfiler(app)
+
+# gzip (plus brotli and zstd when installed) for clients that accept it.
+# BLOG_COMPRESSION lists the encodings in order of preference with their
+# levels, e.g. "br=5,gzip=6"; an empty value turns compression off. Created
+# after METRICS so that the sizes recorded are those actually sent.
+COMPRESSION = ResponseCompression(
+    app, parse_levels(os.environ.get('BLOG_COMPRESSION', DEFAULT_COMPRESSION_LEVELS)),
+    int(os.environ.get('BLOG_COMPRESSION_MIN_BYTES', DEFAULT_COMPRESSION_MIN_BYTES)))
+
+
+# Number of posts read from the store at a time while streaming
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson():
+    """Whether the client explicitly accepts newline-delimited JSON"""
+    return any(mimetype == 'application/x-ndjson' for mimetype, _ in request.accept_mimetypes)
+
+
+def wants_stream():
+    """Whether the client asked for a streamed response"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes') or wants_ndjson()
+
+
+# Fields a response can be narrowed to with ?fields=
+PROJECTION_FIELDS = Post.FIELDS
+
+
+def read_projection():
+    """The (fields, excerpt length) asked for with ?fields= and ?excerpt=
+
+    Returns None when whole posts were asked for. Raises ValueError with a
+    message for the client if either parameter is invalid.
+    """
+    fields_arg, excerpt_arg = request.args.get('fields'), request.args.get('excerpt')
+    if fields_arg is None and excerpt_arg is None:
+        return None
+    
+    fields = PROJECTION_FIELDS
+    if fields_arg is not None:
+        fields = tuple(field.strip() for field in fields_arg.split(',') if field.strip())
+        if not fields or any(field not in PROJECTION_FIELDS for field in fields):
+            raise ValueError(
+                f"Invalid fields '{fields_arg}'. Valid options are: {', '.join(PROJECTION_FIELDS)}")
+    
+    excerpt = None
+    if excerpt_arg is not None:
+        if not excerpt_arg.isdigit() or int(excerpt_arg) < 1:
+            raise ValueError(f"Invalid excerpt '{excerpt_arg}'. It must be a positive number of characters.")
+        excerpt = int(excerpt_arg)
+    return fields, excerpt
+
+
+def encode_post(post, projection=None):
+    """Encoded JSON of a post, or of the fields a projection keeps"""
+    if projection is None:
+        return ENCODED_POSTS.get(post)
+    return app.json.encode(post.project(*projection))
+
+
+def stream_posts(posts, ndjson=False, projection=None):
+    """Build a response that serializes posts one at a time as they are sent"""
+    def generate_array():
+        yield b'['
+        for i, post in enumerate(posts):
+            yield (b',' if i else b'') + encode_post(post, projection)
+        yield b']\n'
+
+    def generate_ndjson():
+        for post in posts:
+            yield encode_post(post, projection) + b'\n'
+
+    if ndjson:
+        return Response(generate_ndjson(), mimetype='application/x-ndjson')
+    return Response(generate_array(), mimetype='application/json')
+
+
+def conditional(view):
+    """Answer GETs with 304 Not Modified when the client's copy is current
+
+    Responses carry a weak ETag and a Last-Modified date derived from the
+    store version, which every write bumps. The version is read before the
+    view runs, so a write that races with the view only makes the validators
+    older, never newer than the data sent.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation, version, modified_at = POSTS.version()
+        etag = encode_version(generation, version)
+        last_modified = datetime.fromtimestamp(int(modified_at), tz=timezone.utc)
+
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        return response
+    return wrapper
+
+
+def cache_key(*parts):
+    """Cache key for a response from its normalized query parameters"""
+    return json.dumps(parts, separators=(',', ':'))
+
+
+def posts_json(posts, projection=None):
+    """JSON body of a list of posts"""
+    if projection is None:
+        body = ENCODED_POSTS.encode_list(posts)
+    else:
+        body = b'[' + b','.join([encode_post(post, projection) for post in posts]) + b']'
+    checkpoint('serialization')
+    return body
+
+
+def page_json(posts, next_cursor, projection=None):
+    """JSON body of one page of posts"""
+    body = b''.join([
+        b'{"next_cursor":', app.json.encode(next_cursor), b',"posts":', posts_json(posts, projection), b'}'])
+    checkpoint('serialization')
+    return body
+
+
+def cached_json(key, dependency, build):
+    """Serve a JSON response from the response cache, building its body on a miss
+
+    Compressed bodies are cached next to the plain one, under the same
+    dependency, so each is compressed once per encoding until a write
+    invalidates it.
+    """
+    checkpoint('validation')
+    encoding = COMPRESSION.choose_encoding()
+    if encoding is not None:
+        compressed = RESPONSE_CACHE.get(f"{key}:{encoding}")
+        if compressed is not None:
+            checkpoint('cache')
+            response = app.response_class(compressed, mimetype='application/json')
+            response.headers['Content-Encoding'] = encoding
+            return response
+    token = RESPONSE_CACHE.token()
+    body = RESPONSE_CACHE.get(key)
+    checkpoint('cache')
+    if body is None:
+        body = build() + b'\n'
+        RESPONSE_CACHE.put(key, body, dependency, token)
+        checkpoint('cache')
+    response = app.response_class(body, mimetype='application/json')
+    if encoding is not None and len(body) >= COMPRESSION.min_bytes:
+        COMPRESSION.compressed_response(response, body, encoding)
+        checkpoint('compression')
+        RESPONSE_CACHE.put(f"{key}:{encoding}", response.get_data(), dependency, token)
+    return response
+
+
+def wants_page():
+    """Whether the client asked for a paginated response"""
+    return 'limit' in request.args or 'cursor' in request.args
+
 
 @app.route('/api/posts', methods=['GET'])
+@conditional
 def get_posts():
-    """Get all blog posts with optional sorting"""
+    """Get all blog posts with optional sorting, pagination and field projection"""
     # Get query parameters for sorting
     sort_field = request.args.get('sort')
     sort_direction = request.args.get('direction')
     
     # Define valid parameters
-    valid_sort_fields = ['title', 'content']
+    valid_sort_fields = list(SORT_FIELDS)
     valid_directions = ['asc', 'desc']
     
     # Validate sort parameters if provided
@@ -42,15 +297,83 @@ def get_posts():
             "error": "Direction parameter requires a sort field. Please provide both 'sort' and 'direction' parameters."
         }), 400
     
-    # Make a copy of POSTS to avoid modifying the original list
-    posts_to_return = POSTS.copy()
+    # Validate the projection to fewer fields, if requested
+    try:
+        projection = read_projection()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    
+    # Return a single page if pagination was requested
+    if wants_page():
+        scope = listing_scope(sort_field, sort_direction)
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            after = decode_cursor(request.args.get('cursor'), scope)
+        except PaginationError as error:
+            return jsonify({"error": str(error)}), 400
+        
+        def build_page():
+            posts, next_position = POSTS.page(sort_field or None, sort_direction == 'desc', after, limit)
+            checkpoint('sort' if sort_field else 'store')
+            return page_json(posts, encode_cursor(scope, next_position), projection)
+        return cached_json(cache_key('posts', scope, limit, after, projection), None, build_page)
+    
+    # Stream the listing straight from the store if requested
+    if wants_stream():
+        checkpoint('validation')
+        posts = POSTS.iter(sort_field or None, sort_direction == 'desc', STREAM_BATCH_SIZE)
+        return stream_posts(posts, ndjson=wants_ndjson(), projection=projection)
+    
+    # Read posts from the presorted index if sorting was requested
+    def build_listing():
+        if sort_field:
+            posts = POSTS.sorted(sort_field, descending=(sort_direction == 'desc'))
+            checkpoint('sort')
+        else:
+            posts = POSTS.all()
+            checkpoint('store')
+        return posts_json(posts, projection)
+    
+    key = cache_key('posts', listing_scope(sort_field, sort_direction), projection)
+    return cached_json(key, None, build_listing)
+
+
+@app.route('/api/posts/<int:post_id>', methods=['GET'])
+@conditional
+def get_post(post_id):
+    """Get a single blog post by ID, with optional field projection"""
+    # Validate the projection to fewer fields, if requested
+    try:
+        projection = read_projection()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
     
-    # Apply sorting if parameters are provided
-    if sort_field:
-        reverse_order = (sort_direction == 'desc')
-        posts_to_return.sort(key=lambda post: post[sort_field].lower(), reverse=reverse_order)
+    # Look the post up by ID
+    checkpoint('validation')
+    post = POSTS.get(post_id)
+    checkpoint('store')
+    if post is None:
+        return jsonify({
+            "error": f"Post with id {post_id} not found."
+        }), 404
     
-    return jsonify(posts_to_return)
+    return app.response_class(encode_post(post, projection) + b'\n', mimetype='application/json')
+
+
+def missing_post_fields(data):
+    """Names of the required post fields that are missing or empty"""
+    missing_fields = []
+    if 'title' not in data or not data['title']:
+        missing_fields.append('title')
+    if 'content' not in data or not data['content']:
+        missing_fields.append('content')
+    return missing_fields
+
+
+def invalid_post_fields(data):
+    """Names of the post fields that are given but are not strings"""
+    return [field for field in ('title', 'content')
+            if data.get(field) is not None and not isinstance(data[field], str)]
 
 
 @app.route('/api/posts', methods=['POST'])
@@ -64,29 +387,23 @@ def add_post():
         return jsonify({"error": "No JSON data provided"}), 400
     
     # Check for required fields
-    missing_fields = []
-    if 'title' not in data or not data['title']:
-        missing_fields.append('title')
-    if 'content' not in data or not data['content']:
-        missing_fields.append('content')
-    
+    missing_fields = missing_post_fields(data)
     if missing_fields:
         return jsonify({
             "error": f"Missing required fields: {', '.join(missing_fields)}"
         }), 400
     
-    # Generate new unique ID
-    new_id = max([post['id'] for post in POSTS]) + 1 if POSTS else 1
-    
-    # Create new post
-    new_post = {
-        "id": new_id,
-        "title": data['title'],
-        "content": data['content']
-    }
+    # Check that the fields are text
+    invalid_fields = invalid_post_fields(data)
+    if invalid_fields:
+        return jsonify({
+            "error": f"Fields must be strings: {', '.join(invalid_fields)}"
+        }), 400
     
-    # Add to posts list
-    POSTS.append(new_post)
+    # Create new post (the store allocates a new unique ID)
+    checkpoint('validation')
+    new_post = POSTS.create(data['title'], data['content'])
+    checkpoint('store')
     
     # Return the new post with 201 Created status
     return jsonify(new_post), 201
@@ -95,12 +412,9 @@ def add_post():
 @app.route('/api/posts/<int:post_id>', methods=['DELETE'])
 def delete_post(post_id):
     """Delete a blog post by ID"""
-    # Find the post with the given ID
-    post_to_delete = None
-    for i, post in enumerate(POSTS):
-        if post['id'] == post_id:
-            post_to_delete = POSTS.pop(i)
-            break
+    # Remove the post with the given ID
+    post_to_delete = POSTS.delete(post_id)
+    checkpoint('store')
     
     # Check if post was found and deleted
     if post_to_delete:
@@ -119,12 +433,19 @@ def update_post(post_id):
     # Get JSON data from request
     data = request.get_json()
     
-    # Find the post with the given ID
-    post_to_update = None
-    for post in POSTS:
-        if post['id'] == post_id:
-            post_to_update = post
-            break
+    # Update the post (keep existing values if not provided)
+    if not isinstance(data, dict):
+        data = {}
+    
+    # Check that the given fields are text
+    invalid_fields = invalid_post_fields(data)
+    if invalid_fields:
+        return jsonify({
+            "error": f"Fields must be strings: {', '.join(invalid_fields)}"
+        }), 400
+    checkpoint('validation')
+    post_to_update = POSTS.update(post_id, title=data.get('title'), content=data.get('content'))
+    checkpoint('store')
     
     # Check if post was found
     if not post_to_update:
@@ -132,41 +453,346 @@ def update_post(post_id):
             "error": f"Post with id {post_id} not found."
         }), 404
     
-    # Update the post (keep existing values if not provided)
-    if data and 'title' in data and data['title']:
-        post_to_update['title'] = data['title']
-    
-    if data and 'content' in data and data['content']:
-        post_to_update['content'] = data['content']
-    
     # Return the updated post with 200 OK status
     return jsonify(post_to_update), 200
 
 
+# Largest number of posts or IDs accepted by one bulk request
+MAX_BULK_ITEMS = 10000
+
+
+def is_post_id(value):
+    return type(value) is int
+
+
+def read_bulk_items(key):
+    """Get the list of items from a bulk request body
+
+    The body is either a JSON list or an object with the list under `key`.
+    Returns (items, None) or (None, error response).
+    """
+    data = request.get_json()
+    if data is None:
+        return None, (jsonify({"error": "No JSON data provided"}), 400)
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        return None, (jsonify({
+            "error": f"Expected a JSON list or an object with a '{key}' list."
+        }), 400)
+    if len(data) > MAX_BULK_ITEMS:
+        return None, (jsonify({
+            "error": f"Too many items: {len(data)}. A bulk request accepts at most {MAX_BULK_ITEMS}."
+        }), 400)
+    return data, None
+
+
+def invalid_batch(errors):
+    """Response for a batch that failed validation (nothing is applied)"""
+    return jsonify({
+        "error": "Invalid items in batch. No changes were made.",
+        "errors": errors
+    }), 400
+
+
+@app.route('/api/posts/bulk', methods=['POST'])
+def add_posts_bulk():
+    """Add many blog posts in one atomic batch"""
+    items, error_response = read_bulk_items('posts')
+    if error_response:
+        return error_response
+    
+    # Validate every item before anything is written
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "error": "Expected a JSON object."})
+            continue
+        missing_fields = missing_post_fields(item)
+        invalid_fields = invalid_post_fields(item)
+        if missing_fields:
+            errors.append({"index": index, "error": f"Missing required fields: {', '.join(missing_fields)}"})
+        elif invalid_fields:
+            errors.append({"index": index, "error": f"Fields must be strings: {', '.join(invalid_fields)}"})
+    if errors:
+        return invalid_batch(errors)
+    
+    checkpoint('validation')
+    new_posts = POSTS.create_many(items)
+    checkpoint('store')
+    
+    results = [{"index": index, "status": 201, "post": post} for index, post in enumerate(new_posts)]
+    return jsonify({"results": results}), 201
+
+
+@app.route('/api/posts/bulk', methods=['PUT'])
+def update_posts_bulk():
+    """Update many blog posts in one atomic batch"""
+    items, error_response = read_bulk_items('posts')
+    if error_response:
+        return error_response
+    
+    # Validate every item before anything is written
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not is_post_id(item.get('id')):
+            errors.append({"index": index, "error": "Expected a JSON object with an integer 'id'."})
+            continue
+        invalid_fields = invalid_post_fields(item)
+        if invalid_fields:
+            errors.append({"index": index, "error": f"Fields must be strings: {', '.join(invalid_fields)}"})
+    if errors:
+        return invalid_batch(errors)
+    
+    checkpoint('validation')
+    updated_posts = POSTS.update_many(items)
+    checkpoint('store')
+    
+    results = []
+    for index, (item, post) in enumerate(zip(items, updated_posts)):
+        if post is None:
+            results.append({"index": index, "status": 404, "error": f"Post with id {item['id']} not found."})
+        else:
+            results.append({"index": index, "status": 200, "post": post})
+    return jsonify({"results": results}), 200
+
+
+@app.route('/api/posts/bulk', methods=['DELETE'])
+def delete_posts_bulk():
+    """Delete many blog posts by ID in one atomic batch"""
+    post_ids, error_response = read_bulk_items('ids')
+    if error_response:
+        return error_response
+    
+    # Validate every ID before anything is deleted
+    errors = [{"index": index, "error": "Expected an integer post id."}
+              for index, post_id in enumerate(post_ids) if not is_post_id(post_id)]
+    if errors:
+        return invalid_batch(errors)
+    
+    checkpoint('validation')
+    deleted_posts = POSTS.delete_many(post_ids)
+    checkpoint('store')
+    
+    results = []
+    for index, (post_id, post) in enumerate(zip(post_ids, deleted_posts)):
+        if post is None:
+            results.append({"index": index, "status": 404, "error": f"Post with id {post_id} not found."})
+        else:
+            results.append({
+                "index": index, "status": 200,
+                "message": f"Post with id {post_id} has been deleted successfully."
+            })
+    return jsonify({"results": results}), 200
+
+
 @app.route('/api/posts/search', methods=['GET'])
+@conditional
 def search_posts():
-    """Search for blog posts by title or content"""
+    """Search for blog posts by title or content, with optional pagination and field projection"""
     # Get query parameters
-    title_query = request.args.get('title', '').lower()
-    content_query = request.args.get('content', '').lower()
+    title_query = request.args.get('title', '')
+    content_query = request.args.get('content', '')
+    mode = request.args.get('mode', 'substring')
+    
+    # Validate search mode
+    if mode not in SEARCH_MODES:
+        return jsonify({
+            "error": f"Invalid search mode '{mode}'. Valid options are: {', '.join(SEARCH_MODES)}"
+        }), 400
+    
+    # Validate the projection to fewer fields, if requested
+    try:
+        projection = read_projection()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    
+    # Validate pagination parameters
+    if wants_page():
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            after = decode_cursor(request.args.get('cursor'), 'search')
+        except PaginationError as error:
+            return jsonify({"error": str(error)}), 400
     
     # If no search parameters provided, return empty list
     if not title_query and not content_query:
-        return jsonify([])
+        return jsonify({"posts": [], "next_cursor": None} if wants_page() else [])
     
-    # Filter posts based on search criteria
-    matching_posts = []
+    dependency = search_dependency(title_query, content_query, mode)
     
-    for post in POSTS:
-        # Check if post matches search criteria
-        title_match = title_query and title_query in post['title'].lower()
-        content_match = content_query and content_query in post['content'].lower()
-        
-        # Add post if it matches any of the search criteria
-        if title_match or content_match:
-            matching_posts.append(post)
+    # Return a single page of matches if pagination was requested
+    if wants_page():
+        def build_page():
+            posts, next_position = POSTS.search_page(
+                title=title_query, content=content_query, mode=mode, after=after, limit=limit)
+            checkpoint('search')
+            return page_json(posts, encode_cursor('search', next_position), projection)
+        key = cache_key('search', mode, title_query, content_query, limit, after, projection)
+        return cached_json(key, dependency, build_page)
+    
+    # Look up matching posts in the search index (title OR content)
+    def build_results():
+        posts = POSTS.search(title=title_query, content=content_query, mode=mode)
+        checkpoint('search')
+        return posts_json(posts, projection)
+    
+    key = cache_key('search', mode, title_query, content_query, projection)
+    return cached_json(key, dependency, build_results)
+
+
+@app.route('/api/posts/changes', methods=['GET'])
+def get_changes():
+    """Get the writes made since a version, or tell the client to reload everything"""
+    generation, version, _ = POSTS.version()
+    since = request.args.get('since')
+    
+    # Without a version the client is told to load the posts and start from the current one
+    changes = None
+    if since:
+        try:
+            since_generation, since_version = decode_version(since)
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        if since_generation == generation:
+            changes = CHANGES.since(since_version, version)
+    
+    return jsonify({
+        "version": encode_version(generation, version),
+        "resync": changes is None,
+        "changes": [change.to_dict() for change in changes or []],
+    })
+
+
+def event_stream_preamble(subscription, last_event_id):
+    """Start of a new event stream: the writes made after `last_event_id`, or a resync event
+
+    Call after subscribing, so that no write falls between the two; events
+    both replayed here and queued for the subscription are sent once.
+    """
+    if not last_event_id:
+        return format_preamble()
+    generation, version, _ = POSTS.version()
+    changes = None
+    try:
+        since_generation, since_version = decode_version(last_event_id)
+    except ValueError:
+        since_generation = None
+    if since_generation == generation:
+        changes = CHANGES.since(since_version, version)
+    if changes is None:
+        return format_preamble(resync=True)
+    subscription.skip_through(changes[-1].version if changes else since_version)
+    return format_preamble(format_event(generation, change, app.json.encode) for change in changes)
+
+
+@app.route('/api/posts/stream', methods=['GET'])
+def stream_events():
+    """Push every create, update and delete to the client as server-sent events
+
+    Resumes after the Last-Event-ID header (or the `since` parameter, for a
+    first connection). This version holds a thread per connection; under
+    ASGI the stream is served on the event loop instead (see asgi_app).
+    """
+    ready = threading.Event()
+    try:
+        subscription = EVENTS.subscribe(ready.set)
+    except EventStreamFull as error:
+        return jsonify({"error": str(error)}), 503
+    
+    close = functools.partial(EVENTS.unsubscribe, subscription)
+    try:
+        preamble = event_stream_preamble(
+            subscription, request.headers.get('Last-Event-ID') or request.args.get('since'))
+    except BaseException:
+        close()
+        raise
+    return Response(thread_events(subscription, ready, preamble, close), mimetype=EVENT_STREAM_CONTENT_TYPE,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit, miss, eviction and invalidation counters of the response cache"""
+    return jsonify(RESPONSE_CACHE.stats())
+
+
+def check_profiling_access():
+    """Error response unless profiling is enabled and the request carries the admin token"""
+    if not PROFILING_TOKEN:
+        abort(404)
+    expected = f"Bearer {PROFILING_TOKEN}".encode('utf-8')
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), expected):
+        return jsonify({"error": "Profiling requires the admin token."}), 401
+    return None
+
+
+def number_arg(name, default, maximum, convert=float):
+    """Read a positive number from the query string, raising ValueError if it is invalid"""
+    value = convert(request.args.get(name, default))
+    if not 0 < value <= maximum:
+        raise ValueError(f"'{name}' must be greater than 0 and at most {maximum}.")
+    return value
+
+
+@app.route('/api/admin/profile/sample', methods=['POST'])
+def profile_sample():
+    """Sample the stacks of all threads for some seconds and return them collapsed"""
+    error_response = check_profiling_access()
+    if error_response:
+        return error_response
+    
+    try:
+        seconds = number_arg('seconds', 5, MAX_SAMPLE_SECONDS)
+        interval = number_arg('interval', DEFAULT_SAMPLE_INTERVAL, 1)
+    except ValueError as error:
+        return jsonify({"error": f"Invalid sampling parameters: {error}"}), 400
+    
+    return Response(sample_stacks(seconds, interval), mimetype='text/plain')
+
+
+@app.route('/api/admin/profile/requests', methods=['POST'])
+def profile_requests():
+    """Profile the next requests to a route with cProfile"""
+    error_response = check_profiling_access()
+    if error_response:
+        return error_response
     
-    return jsonify(matching_posts)
+    # Validate the route and limits
+    route = request.args.get('route', '')
+    if route not in {rule.rule for rule in app.url_map.iter_rules()}:
+        return jsonify({"error": f"Unknown route '{route}'. Pass a URL rule such as /api/posts/search."}), 400
+    output_format = request.args.get('format', 'pstats')
+    if output_format not in ('pstats', 'text'):
+        return jsonify({"error": f"Invalid format '{output_format}'. Valid options are: pstats, text"}), 400
+    try:
+        count = number_arg('count', 10, MAX_PROFILED_REQUESTS, convert=int)
+        timeout = number_arg('timeout', 60, MAX_PROFILE_TIMEOUT)
+    except ValueError as error:
+        return jsonify({"error": f"Invalid profiling parameters: {error}"}), 400
+    
+    # Wait for the requests to arrive and be profiled
+    try:
+        stats, profiled = PROFILER.profile(route, count, timeout)
+    except RuntimeError as error:
+        return jsonify({"error": str(error)}), 409
+    if stats is None:
+        return jsonify({"error": f"No requests to {route} arrived within {timeout:g} seconds."}), 504
+    
+    headers = {"X-Profiled-Requests": str(profiled)}
+    if output_format == 'text':
+        stats.stream = io.StringIO()
+        stats.sort_stats('cumulative').print_stats(50)
+        return Response(stats.stream.getvalue(), mimetype='text/plain', headers=headers)
+    # The format pstats.Stats reads from a file written by dump_stats()
+    headers["Content-Disposition"] = 'attachment; filename="profile.pstats"'
+    return Response(marshal.dumps(stats.stats), mimetype='application/octet-stream', headers=headers)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request, store and cache metrics in the Prometheus text format"""
+    return Response(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == '__main__':
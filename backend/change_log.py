@@ -0,0 +1,87 @@
+"""
+Recent writes to the post store, for clients catching up with them
+"""
+import collections
+import itertools
+import threading
+
+# Number of writes kept; clients further behind reload everything
+DEFAULT_CHANGE_LOG_SIZE = 10000
+
+
+def encode_version(generation, version):
+    """Version string sent to clients, e.g. '5f0c...-42'"""
+    return f"{generation}-{version}"
+
+
+def decode_version(text):
+    """Split a version string into (generation, version); raises ValueError if it is invalid"""
+    generation, _, version = text.rpartition('-')
+    if not generation or not version.isdigit():
+        raise ValueError(f"Invalid version '{text}'. Use the version returned by /api/posts/changes.")
+    return generation, int(version)
+
+
+class Change(collections.namedtuple('Change', ['version', 'old_post', 'new_post'])):
+    """One write: old_post is None for a create and new_post is None for a delete"""
+
+    __slots__ = ()
+
+    @property
+    def action(self):
+        if self.old_post is None:
+            return 'create'
+        return 'delete' if self.new_post is None else 'update'
+
+    def to_dict(self):
+        post = self.new_post or self.old_post
+        return {
+            "action": self.action,
+            "id": post.id,
+            "post": self.new_post.to_dict() if self.new_post is not None else None,
+        }
+
+
+class ChangeLog:
+    """The last `capacity` writes to a store, in version order
+
+    Register post_written() as a store listener. Only writes seen by this
+    process are known: when versions are skipped (writes made by another
+    worker on a shared store) the log starts over after the gap, and since()
+    reports that it can't tell what changed before it.
+    """
+
+    def __init__(self, version, capacity=DEFAULT_CHANGE_LOG_SIZE):
+        self._changes = collections.deque(maxlen=capacity)
+        self._base = version  # every write after this version is in _changes
+        self._lock = threading.Lock()
+
+    def _last_version(self):
+        return self._changes[-1].version if self._changes else self._base
+
+    def post_written(self, version, old_post, new_post):
+        with self._lock:
+            last = self._last_version()
+            if version <= last:
+                # Announced late by a concurrent write; the gap it left is permanent
+                return
+            if version != last + 1:
+                self._changes.clear()
+                self._base = version - 1
+            elif len(self._changes) == self._changes.maxlen:
+                self._base = self._changes[0].version
+            self._changes.append(Change(version, old_post, new_post))
+
+    def since(self, version, current):
+        """The changes after `version` up to the store's `current` version
+
+        Returns None if some of them are not in the log any more (or never
+        were), in which case the client has to reload everything.
+        """
+        with self._lock:
+            if not self._base <= version <= current or self._last_version() < current:
+                return None
+            return list(itertools.islice(self._changes, version - self._base, None))
+
+    def __len__(self):
+        return len(self._changes)
@@ -0,0 +1,132 @@
+"""
+Response compression negotiated with Accept-Encoding
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodings in order of preference, with their compression levels
+DEFAULT_LEVELS = 'br=5,zstd=3,gzip=6'
+# Smaller bodies are sent uncompressed
+DEFAULT_MIN_BYTES = 1024
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+
+class _Compressor:
+    """Incremental compressor: compress() chunks as they come, then finish()"""
+
+    def __init__(self, compress, finish):
+        self.compress = compress
+        self.finish = finish
+
+
+def _gzip(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return _Compressor(compressor.compress, compressor.flush)
+
+
+def _brotli(level):
+    compressor = brotli.Compressor(quality=level)
+    return _Compressor(compressor.process, compressor.finish)
+
+
+def _zstd(level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return _Compressor(compressor.compress, compressor.flush)
+
+
+# Encoding name -> factory of compressors, for the encodings that are installed
+COMPRESSORS = {'gzip': _gzip}
+if brotli is not None:
+    COMPRESSORS['br'] = _brotli
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _zstd
+
+
+def parse_levels(text):
+    """'br=5,gzip=6' -> {'br': 5, 'gzip': 6}, skipping encodings that aren't installed"""
+    levels = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, level = part.partition('=')
+        if name not in ('br', 'zstd', 'gzip'):
+            raise ValueError(f"Unknown compression '{name}'. Valid options are: br, zstd, gzip")
+        if name in COMPRESSORS:
+            levels[name] = int(level)
+    return levels
+
+
+class ResponseCompression:
+    """Flask extension compressing JSON responses for clients that accept it
+
+    Bodies smaller than `min_bytes` are sent as they are; streamed responses
+    are compressed chunk by chunk as they are sent. `levels` maps the
+    encodings to use, in order of preference, to their compression level.
+    Responses that already carry a Content-Encoding (such as compressed
+    bodies served from the response cache) are left alone.
+    """
+
+    def __init__(self, app=None, levels=None, min_bytes=DEFAULT_MIN_BYTES):
+        self.levels = parse_levels(DEFAULT_LEVELS) if levels is None else levels
+        self.min_bytes = min_bytes
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._compress_response)
+
+    def choose_encoding(self):
+        """The encoding to use for the current request, or None"""
+        if not self.levels:
+            return None
+        return request.accept_encodings.best_match(list(self.levels))
+
+    def compress(self, body, encoding):
+        compressor = COMPRESSORS[encoding](self.levels[encoding])
+        return compressor.compress(body) + compressor.finish()
+
+    def compressed_response(self, response, body, encoding):
+        """Give `response` the compressed form of `body`"""
+        response.set_data(self.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _compress_response(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code != 200:
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers or request.method == 'HEAD':
+            return response
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            compressor = COMPRESSORS[encoding](self.levels[encoding])
+            response.response = _compress_chunks(response.iter_encoded(), compressor)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+        body = response.get_data()
+        if len(body) < self.min_bytes:
+            return response
+        return self.compressed_response(response, body, encoding)
+
+
+def _compress_chunks(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
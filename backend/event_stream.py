@@ -0,0 +1,161 @@
+"""
+Server-sent events announcing every write to the post store
+"""
+import collections
+import threading
+
+from change_log import Change, encode_version
+
+# Events buffered per subscriber; one that falls further behind is disconnected
+DEFAULT_MAX_EVENTS = 256
+DEFAULT_MAX_SUBSCRIBERS = 10000
+# Seconds between comments sent on idle streams, so proxies keep them open
+HEARTBEAT_SECONDS = 15
+# Milliseconds EventSource waits before reconnecting
+RETRY_MILLISECONDS = 3000
+
+CONTENT_TYPE = 'text/event-stream'
+HEARTBEAT = b': keep-alive\n\n'
+RESYNC = b'event: resync\ndata: {}\n\n'
+
+
+class EventStreamFull(Exception):
+    """Raised by EventHub.subscribe() when there are too many subscribers"""
+
+
+def format_event(generation, change, encode):
+    """The change as one server-sent event, with its version as the event ID"""
+    header = f"id: {encode_version(generation, change.version)}\nevent: {change.action}\ndata: "
+    return header.encode('utf-8') + encode(change.to_dict()) + b'\n\n'
+
+
+def format_preamble(events=(), resync=False):
+    """The start of a stream: the reconnection delay, then missed events or a resync event"""
+    return b''.join([f"retry: {RETRY_MILLISECONDS}\n\n".encode('ascii'), *events, RESYNC if resync else b''])
+
+
+class Subscription:
+    """Events waiting to be sent to one client
+
+    `wake` is called (from any thread) whenever events arrive or the
+    subscription is evicted; the client's stream then calls drain().
+    """
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.evicted = False
+        self.sent_through = 0  # queued events up to this version are not sent
+        self.queue = collections.deque()  # (version, encoded event)
+
+    def skip_through(self, version):
+        """Don't send queued events up to `version`, e.g. because they were replayed"""
+        self.sent_through = version
+
+    def drain(self):
+        """Take the encoded events queued since the last call"""
+        events = []
+        while self.queue:
+            version, event = self.queue.popleft()
+            if version > self.sent_through:
+                events.append(event)
+        return events
+
+
+class EventHub:
+    """Fans store writes out to the subscribed event streams
+
+    Register post_written() as a store listener. Each write is encoded once
+    (`encode` returns JSON bytes) and queued for every subscriber; a
+    subscriber with `max_events` events already waiting is evicted instead,
+    so a slow client costs a bounded amount of memory. Its stream ends, and
+    EventSource reconnects with Last-Event-ID to resume from the change log.
+    """
+
+    def __init__(self, generation, encode, max_events=DEFAULT_MAX_EVENTS, max_subscribers=DEFAULT_MAX_SUBSCRIBERS):
+        self.generation = generation
+        self.encode = encode
+        self.max_events = max_events
+        self.max_subscribers = max_subscribers
+        self.evictions = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, wake):
+        subscription = Subscription(wake)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise EventStreamFull("Too many event stream subscribers. Try again later.")
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def post_written(self, version, old_post, new_post):
+        entry = (version, format_event(self.generation, Change(version, old_post, new_post), self.encode))
+        with self._lock:
+            evicted = [subscription for subscription in self._subscribers
+                       if len(subscription.queue) >= self.max_events]
+            for subscription in evicted:
+                subscription.evicted = True
+                self._subscribers.discard(subscription)
+            self.evictions += len(evicted)
+            for subscription in self._subscribers:
+                subscription.queue.append(entry)
+            woken = list(self._subscribers) + evicted
+        for subscription in woken:
+            subscription.wake()
+
+
+class LoopWaker:
+    """Wakes asyncio events from other threads, with one callback per batch
+
+    A write with thousands of subscribers on one event loop schedules a
+    single call on the loop instead of one per subscriber.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def wake(self, event):
+        with self._lock:
+            self._pending.append(event)
+            if len(self._pending) > 1:
+                return
+        try:
+            self.loop.call_soon_threadsafe(self._flush)
+        except RuntimeError:
+            # The loop is closed; nobody is waiting any more
+            pass
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for event in pending:
+            event.set()
+
+
+def thread_events(subscription, ready, preamble, close):
+    """Body of an event stream served by a thread waiting on `ready` (a threading.Event)
+
+    The stream ends when the subscription is evicted; `close` is called once
+    it has ended or the client has gone away.
+    """
+    try:
+        yield preamble
+        while not subscription.evicted:
+            woken = ready.wait(HEARTBEAT_SECONDS)
+            ready.clear()
+            events = subscription.drain()
+            if events:
+                yield b''.join(events)
+            elif not woken:
+                yield HEARTBEAT
+    finally:
+        close()
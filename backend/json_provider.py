@@ -0,0 +1,126 @@
+"""
+Fast JSON encoding of responses and of individual posts
+"""
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+
+from post import Post
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Size limit of the encoded posts kept for building listings
+DEFAULT_ENCODED_POST_BYTES = 256 * 1024 * 1024
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson when it is installed
+
+    Output matches Flask's default provider: sorted keys, compact separators
+    (indented in debug mode), dates as HTTP dates, posts as JSON objects. The
+    one difference is that orjson writes non-ASCII characters as UTF-8
+    instead of \\u escapes.
+    Without orjson, or for anything orjson can't handle (integers beyond 64
+    bits, NaN, custom keyword arguments), the standard library is used.
+    """
+
+    def __init__(self, app, use_orjson=True):
+        super().__init__(app)
+        self.use_orjson = use_orjson and orjson is not None
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, Post):
+            return obj.to_dict()
+        return DefaultJSONProvider.default(obj)
+
+    def _orjson_options(self, kwargs):
+        """orjson options equivalent to json.dumps() keyword arguments, or None"""
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        for name, value in kwargs.items():
+            if name == 'indent' and value == 2:
+                options |= orjson.OPT_INDENT_2
+            elif not (name == 'separators' and tuple(value) == (',', ':')):
+                return None
+        return options
+
+    def encode(self, obj):
+        """Compact JSON of obj as UTF-8 bytes"""
+        if self.use_orjson:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._orjson_options({}))
+            except TypeError:
+                pass
+        return super().dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        options = self._orjson_options(kwargs) if self.use_orjson else None
+        if options is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=options).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # Let the standard library decide, so exactly the same documents are accepted
+                pass
+        return super().loads(s, **kwargs)
+
+
+class EncodedPostCache:
+    """Encoded JSON of individual posts, reused to build listings
+
+    A listing body is built by joining the cached bytes of its posts instead
+    of encoding every post again. An entry is only used while it was encoded
+    from an equal post, so a stale entry is never served; register
+    post_written() as a store listener to free the entries of updated and
+    deleted posts right away. Once `max_bytes` are cached, further posts are
+    encoded on every use rather than evicting others.
+    """
+
+    def __init__(self, encode, max_bytes=DEFAULT_ENCODED_POST_BYTES):
+        self._encode = encode
+        self.max_bytes = max_bytes
+        self._entries = {}  # post ID -> (post, encoded bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, post):
+        """Encoded JSON of one post"""
+        entry = self._entries.get(post.id)
+        if entry is not None and (entry[0] is post or entry[0] == post):
+            return entry[1]
+        encoded = self._encode(post)
+        if self._bytes + len(encoded) <= self.max_bytes:
+            with self._lock:
+                old_entry = self._entries.get(post.id)
+                self._entries[post.id] = (post, encoded)
+                self._bytes += len(encoded) - (len(old_entry[1]) if old_entry else 0)
+        return encoded
+
+    def encode_list(self, posts):
+        """Encoded JSON array of posts"""
+        return b'[' + b','.join([self.get(post) for post in posts]) + b']'
+
+    def post_written(self, version, old_post, new_post):
+        if old_post is None:
+            return
+        with self._lock:
+            entry = self._entries.pop(old_post.id, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def size(self):
+        """(number of entries, total bytes)"""
+        with self._lock:
+            return len(self._entries), self._bytes
@@ -0,0 +1,209 @@
+"""
+Request metrics in the Prometheus text exposition format
+"""
+import bisect
+import math
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the response size histogram buckets, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value per label set that only goes up"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name + _labels(self.label_names, labels), value
+
+
+class Histogram:
+    """Observations per label set, counted into cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                self._values[labels] = entry = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][position] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.label_names, labels, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum' + _labels(self.label_names, labels), total
+            yield self.name + '_count' + _labels(self.label_names, labels), cumulative
+
+
+class Gauge:
+    """Values read from a callback when the metrics are collected
+
+    The callback returns a number, or a list of (label values, number).
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, read, labels=(), type='gauge'):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.type = type
+        self._read = read
+
+    def samples(self):
+        values = self._read()
+        if values is None:
+            return
+        if not isinstance(values, list):
+            values = [((), values)]
+        for labels, value in values:
+            yield self.name + _labels(self.label_names, labels), value
+
+
+class Registry:
+    """The metrics of one process"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name} {_number(value)}" for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """Splits the time spent on one request into named phases
+
+    checkpoint(phase) charges the time since the previous checkpoint (or the
+    start of the request) to `phase`.
+    """
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.phases = {}
+
+    def checkpoint(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+
+def checkpoint(phase):
+    """Charge the time since the last checkpoint of the current request to `phase`"""
+    timer = g.get('request_timer')
+    if timer is not None:
+        timer.checkpoint(phase)
+
+
+class RequestMetrics:
+    """Flask extension recording latency, size and status of every request
+
+    Requests are labelled by method and URL rule (not the raw path), so
+    /api/posts/1 and /api/posts/2 share a series. Phases marked with
+    checkpoint() are recorded in a separate histogram per route.
+    """
+
+    def __init__(self, app=None, registry=None):
+        self.registry = registry or Registry()
+        self.requests = self.registry.register(Counter(
+            'blog_http_requests_total', "HTTP requests answered", ('method', 'route', 'status')))
+        self.latency = self.registry.register(Histogram(
+            'blog_http_request_duration_seconds', "Time to build a response", ('method', 'route')))
+        self.sizes = self.registry.register(Histogram(
+            'blog_http_response_size_bytes', "Size of non-streamed response bodies", ('method', 'route'),
+            buckets=SIZE_BUCKETS))
+        self.phases = self.registry.register(Histogram(
+            'blog_http_request_phase_seconds', "Time spent in each phase of a request", ('route', 'phase')))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.request_timer = RequestTimer()
+
+    def _finish(self, response):
+        timer = g.pop('request_timer', None)
+        if timer is None:
+            return response
+        if timer.phases:
+            # Whatever followed the last checkpoint, usually encoding the response
+            timer.checkpoint('response')
+        elapsed = time.perf_counter() - timer.started
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.requests.inc(request.method, route, str(response.status_code))
+        self.latency.observe(elapsed, request.method, route)
+        if not response.is_streamed:
+            self.sizes.observe(response.calculate_content_length() or 0, request.method, route)
+        for phase, seconds in timer.phases.items():
+            self.phases.observe(seconds, route, phase)
+        return response
+
+    def render(self):
+        return self.registry.render()
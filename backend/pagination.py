@@ -0,0 +1,63 @@
+"""
+Opaque cursors and page sizes for paginated post listings
+"""
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class PaginationError(ValueError):
+    """Raised for an invalid limit or cursor; the message is shown to the client"""
+
+
+def listing_scope(sort_field=None, sort_direction=None):
+    """Name of the ordering a cursor belongs to, e.g. 'id' or 'title:desc'"""
+    if not sort_field:
+        return 'id'
+    return f"{sort_field}:{sort_direction or 'asc'}"
+
+
+def parse_limit(value):
+    """Validate the `limit` query parameter, defaulting to DEFAULT_PAGE_SIZE"""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PaginationError(f"Invalid limit '{value}'. Limit must be an integer between 1 and {MAX_PAGE_SIZE}.")
+    return limit
+
+
+def encode_cursor(scope, position):
+    """Turn a store position into an opaque cursor string (None stays None)"""
+    if position is None:
+        return None
+    raw = json.dumps([scope, position], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, scope):
+    """Turn a cursor string back into a store position for the given scope"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_scope, position = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise PaginationError("Invalid cursor.") from None
+
+    if cursor_scope != scope:
+        raise PaginationError("Cursor does not match the requested sort order.")
+    if scope in ('id', 'search'):
+        if type(position) is not int:
+            raise PaginationError("Invalid cursor.")
+        return position
+    if not (isinstance(position, list) and len(position) == 2
+            and isinstance(position[0], str) and type(position[1]) is int):
+        raise PaginationError("Invalid cursor.")
+    return tuple(position)
@@ -0,0 +1,78 @@
+"""
+The blog post model
+"""
+from search_index import normalize
+
+
+class Post:
+    """A blog post
+
+    Posts use __slots__ instead of a per-post dict, which saves more than
+    100 bytes per stored post. Stores never modify a post once it is stored
+    (an update stores a new Post), so a post handed out to a reader never
+    changes under it.
+
+    title_key and content_key hold the casefolded title and content, which
+    sorting and searching use instead of casefolding on every request. They
+    are computed once, when first needed: the in-memory store indexes every
+    post as it is written, while posts read back from a database usually
+    never need them.
+
+    Item access (post['title']) and keys() give the same view as the JSON
+    object, so dict(post) == post.to_dict().
+    """
+
+    __slots__ = ('id', 'title', 'content', 'title_key', 'content_key')
+
+    # Keys of the JSON object
+    FIELDS = ('id', 'title', 'content')
+
+    def __init__(self, id, title, content):
+        self.id = id
+        self.title = title
+        self.content = content
+
+    def __getattr__(self, name):
+        # Only called for slots that are not set yet
+        if name in ('title_key', 'content_key'):
+            key = normalize(getattr(self, name[:-len('_key')]))
+            setattr(self, name, key)
+            return key
+        raise AttributeError(name)
+
+    def key(self, field):
+        """Casefolded value of 'title' or 'content'"""
+        return self.title_key if field == 'title' else self.content_key
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['title'], data['content'])
+
+    def to_dict(self):
+        """The post as a JSON object"""
+        return {"id": self.id, "title": self.title, "content": self.content}
+
+    def project(self, fields, excerpt=None):
+        """JSON object with only the given fields, and content cut to `excerpt` characters"""
+        data = {field: getattr(self, field) for field in fields}
+        if excerpt is not None and len(data.get('content', '')) > excerpt:
+            data['content'] = data['content'][:excerpt].rstrip() + '…'
+        return data
+
+    def keys(self):
+        return self.FIELDS
+
+    def __getitem__(self, field):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __eq__(self, other):
+        if not isinstance(other, Post):
+            return NotImplemented
+        return self.id == other.id and self.title == other.title and self.content == other.content
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Post(id={self.id!r}, title={self.title!r}, content={self.content!r})"
@@ -0,0 +1,287 @@
+"""
+Append-only write-ahead log and snapshots for the in-memory post store
+"""
+import json
+import os
+import threading
+import uuid
+
+from post import Post
+from post_store import PostStore
+
+# Seconds between background fsyncs of the log
+# (0 = fsync every write, None = leave flushing to the operating system)
+DEFAULT_FSYNC_INTERVAL = 0.05
+# Number of logged writes after which a new snapshot is taken
+DEFAULT_SNAPSHOT_EVERY = 100000
+
+
+class PostJournal:
+    """Append-only log of post writes, compacted into periodic snapshots
+
+    Files, for a journal at `path`:
+    - `path`: the current log, one JSON record per line
+    - `path.old`: the previous log while a snapshot is being written
+    - `path.snapshot`: all posts as of a given log sequence number
+    - `path.generation`: a random ID for this journal, created with it
+
+    Every record carries a sequence number, so records already contained in
+    the snapshot are skipped on replay no matter where a crash happened.
+    """
+
+    def __init__(self, path, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.old_path = path + '.old'
+        self.snapshot_path = path + '.snapshot'
+        self.generation_path = path + '.generation'
+        self.fsync_interval = fsync_interval
+        self.sequence = 0
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._syncer = None
+
+    def replay(self):
+        """Read the snapshot and logs, returning (posts by ID, next ID)"""
+        posts, next_id = {}, 1
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.sequence = snapshot['sequence']
+            next_id = snapshot['next_id']
+            posts = {post['id']: Post.from_dict(post) for post in snapshot['posts']}
+
+        for path in (self.old_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write at the end of the log; nothing after it was acknowledged
+                        break
+                    if record['seq'] <= self.sequence:
+                        continue
+                    self.sequence = record['seq']
+                    if record['op'] == 'put':
+                        post = Post.from_dict(record['post'])
+                        posts[post.id] = post
+                        next_id = max(next_id, post.id + 1)
+                    elif record['op'] == 'delete':
+                        posts.pop(record['id'], None)
+        return posts, next_id
+
+    def generation(self):
+        """Random ID of this journal, created on first use"""
+        if not os.path.exists(self.generation_path):
+            with open(self.generation_path, 'w', encoding='utf-8') as generation_file:
+                generation_file.write(uuid.uuid4().hex)
+        with open(self.generation_path, encoding='utf-8') as generation_file:
+            return generation_file.read().strip()
+
+    def open(self):
+        """Start appending to the log"""
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self.fsync_interval:
+            self._syncer = threading.Thread(target=self._sync_periodically, name='post-journal-fsync', daemon=True)
+            self._syncer.start()
+
+    def log_put(self, post):
+        """Record that a post was created or updated"""
+        self._append({"op": "put", "post": post.to_dict()})
+
+    def log_delete(self, post_id):
+        """Record that a post was deleted"""
+        self._append({"op": "delete", "id": post_id})
+
+    def _append(self, record):
+        with self._lock:
+            self.sequence += 1
+            record['seq'] = self.sequence
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            if self.fsync_interval == 0:
+                os.fsync(self._file.fileno())
+            else:
+                # Group commit: the background thread fsyncs pending writes together
+                self._dirty = True
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """fsync any writes not yet on disk"""
+        with self._lock:
+            if self._dirty and self._file is not None:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def rotate(self):
+        """Start a new log, returning the sequence number the old one ended at
+
+        The caller then writes a snapshot for that sequence number with
+        write_snapshot(), which removes the old log.
+        """
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            if os.path.exists(self.old_path):
+                # An earlier snapshot never finished; keep its log as well
+                with open(self.old_path, 'a', encoding='utf-8') as old_file, \
+                        open(self.path, encoding='utf-8') as log_file:
+                    old_file.writelines(log_file)
+                    old_file.flush()
+                    os.fsync(old_file.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.old_path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._dirty = False
+            return self.sequence
+
+    def write_snapshot(self, posts, next_id, sequence):
+        """Atomically replace the snapshot and drop the log it covers"""
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump({"sequence": sequence, "next_id": next_id, "posts": [post.to_dict() for post in posts]},
+                      snapshot_file, separators=(',', ':'))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def close(self):
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+class JournaledPostStore(PostStore):
+    """In-memory post store whose writes are logged to a PostJournal
+
+    Reads and writes still happen in memory; each write additionally appends
+    one line to the log. Every `snapshot_every` writes the log is compacted
+    into a snapshot, written by a background thread.
+    """
+
+    def __init__(self, path, posts=None, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+        self.journal = PostJournal(path, fsync_interval)
+        self.snapshot_every = snapshot_every
+        self._writes_since_snapshot = 0
+        self._write_lock = threading.Lock()
+        self._snapshotter = None
+
+        existing_posts, next_id = self.journal.replay()
+        is_new = not existing_posts and self.journal.sequence == 0
+        super().__init__(list(existing_posts.values()))
+        self._next_id = max(self._next_id, next_id)
+        # Every logged write bumps both the store version and the journal
+        # sequence, so the sequence carries the version across restarts
+        self.generation = self.journal.generation()
+        self._state = (self.journal.sequence, self._state[1])
+        self.journal.open()
+
+        # Seed posts are only added to a brand new journal
+        if is_new:
+            for post in posts or []:
+                self.add(post)
+
+    def create(self, title, content):
+        with self._write_lock:
+            post = super().create(title, content)
+            self.journal.log_put(post)
+            self._count_writes()
+        return post
+
+    def add(self, post):
+        with self._write_lock:
+            super().add(post)
+            self.journal.log_put(post)
+            self._count_writes()
+        return post
+
+    def update(self, post_id, title=None, content=None):
+        with self._write_lock:
+            post = super().update(post_id, title=title, content=content)
+            if post is not None:
+                self.journal.log_put(post)
+                self._count_writes()
+        return post
+
+    def delete(self, post_id):
+        with self._write_lock:
+            post = super().delete(post_id)
+            if post is not None:
+                self.journal.log_delete(post_id)
+                self._count_writes()
+        return post
+
+    def create_many(self, items):
+        with self._write_lock:
+            posts = super().create_many(items)
+            for post in posts:
+                self.journal.log_put(post)
+            self._count_writes(len(posts))
+        return posts
+
+    def update_many(self, items):
+        with self._write_lock:
+            posts = super().update_many(items)
+            updated = [post for post in posts if post is not None]
+            for post in updated:
+                self.journal.log_put(post)
+            self._count_writes(len(updated))
+        return posts
+
+    def delete_many(self, post_ids):
+        with self._write_lock:
+            posts = super().delete_many(post_ids)
+            deleted = [post for post in posts if post is not None]
+            for post in deleted:
+                self.journal.log_delete(post.id)
+            self._count_writes(len(deleted))
+        return posts
+
+    def _count_writes(self, count=1):
+        self._writes_since_snapshot += count
+        if self._writes_since_snapshot >= self.snapshot_every and not self._snapshot_running():
+            self._start_snapshot()
+
+    def _snapshot_running(self):
+        return self._snapshotter is not None and self._snapshotter.is_alive()
+
+    def _start_snapshot(self):
+        # Called with the write lock held: copy the posts and rotate the log
+        # here, then write the snapshot file in the background
+        posts = list(self._posts.values())
+        sequence = self.journal.rotate()
+        self._writes_since_snapshot = 0
+        self._snapshotter = threading.Thread(
+            target=self.journal.write_snapshot, args=(posts, self._next_id, sequence),
+            name='post-journal-snapshot', daemon=True)
+        self._snapshotter.start()
+
+    def snapshot(self):
+        """Compact the log into a snapshot of the current posts and wait for it"""
+        with self._write_lock:
+            if self._snapshotter is not None:
+                self._snapshotter.join()
+            self._start_snapshot()
+        self._snapshotter.join()
+
+    def close(self):
+        if self._snapshotter is not None:
+            self._snapshotter.join()
+        self.journal.close()
@@ -0,0 +1,410 @@
+"""
+Storage interface for blog posts and its in-memory implementation
+"""
+import abc
+import bisect
+import heapq
+import itertools
+import math
+import time
+import uuid
+
+from post import Post
+from rwlock import ReadWriteLock
+from search_index import SearchIndex
+
+# Fields that have a presorted index
+SORT_FIELDS = ('title', 'content')
+
+
+def sort_key(text):
+    """Case-insensitive sort key for a title or content string"""
+    return text.casefold()
+
+
+def check_post(post):
+    """Raise TypeError unless a post's title and content are strings
+
+    Also computes the post's sort keys, so that a bad write fails here,
+    before the store has changed, not halfway through updating its indexes.
+    """
+    if not isinstance(post.title, str) or not isinstance(post.content, str):
+        raise TypeError(f"Post title and content must be strings, got {post!r}")
+    for field in SORT_FIELDS:
+        post.key(field)
+
+
+class BasePostStore(abc.ABC):
+    """Interface the route handlers use to read and write posts
+
+    Posts are Post objects. Listings are in creation (ID) order unless
+    sorted by a field in SORT_FIELDS.
+    """
+
+    def __init__(self):
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call `listener(version, old_post, new_post)` after every write
+
+        `old_post` is None for a create and `new_post` is None for a delete;
+        `version` is the store version the write produced.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, version, old_post, new_post):
+        for listener in self._listeners:
+            listener(version, old_post, new_post)
+
+    @abc.abstractmethod
+    def __len__(self):
+        """Number of stored posts"""
+
+    @abc.abstractmethod
+    def version(self):
+        """Return (generation, version, modified_at) for the stored data
+
+        `version` goes up with every write and `modified_at` is the time of the
+        last write (seconds since the epoch). `generation` identifies the data
+        set, so versions from a store that was wiped and recreated (or an
+        in-memory store after a restart) are never mistaken for current ones.
+        """
+
+    @abc.abstractmethod
+    def all(self):
+        """Return all posts in creation order"""
+
+    @abc.abstractmethod
+    def get(self, post_id):
+        """Return the post with the given ID, or None"""
+
+    @abc.abstractmethod
+    def sorted(self, field, descending=False):
+        """Return all posts ordered by a field, case-insensitively
+
+        Posts with equal values keep their creation order in both directions,
+        like a stable sort would.
+        """
+
+    @abc.abstractmethod
+    def page(self, field=None, descending=False, after=None, limit=100):
+        """Return one page of posts and the position to continue from
+
+        Without a field, posts are in creation order. `after` is the position
+        returned for the previous page: an ID, or a (sort key, ID) pair when
+        sorting. The returned position is None on the last page.
+        """
+
+    @abc.abstractmethod
+    def search(self, title=None, content=None, mode='substring'):
+        """Return posts matching the title query OR the content query
+
+        Results are in creation order.
+        """
+
+    @abc.abstractmethod
+    def search_page(self, title=None, content=None, mode='substring', after=None, limit=100):
+        """Return one page of search results and the ID to continue from
+
+        The returned ID is None on the last page.
+        """
+
+    @abc.abstractmethod
+    def create(self, title, content):
+        """Create a new post with a freshly allocated ID"""
+
+    @abc.abstractmethod
+    def add(self, post):
+        """Store a post that already has an ID"""
+
+    @abc.abstractmethod
+    def update(self, post_id, title=None, content=None):
+        """Update a post (keep existing values if not provided), or return None"""
+
+    @abc.abstractmethod
+    def delete(self, post_id):
+        """Remove a post, returning it, or None if it does not exist"""
+
+    @abc.abstractmethod
+    def create_many(self, items):
+        """Create posts from {"title", "content"} dicts in one atomic step
+
+        Returns the new posts in the same order.
+        """
+
+    @abc.abstractmethod
+    def update_many(self, items):
+        """Apply {"id", "title"?, "content"?} updates in one atomic step
+
+        Returns the updated post, or None for an unknown ID, for each item.
+        """
+
+    @abc.abstractmethod
+    def delete_many(self, post_ids):
+        """Delete posts by ID in one atomic step
+
+        Returns the deleted post, or None for an unknown ID, for each ID.
+        """
+
+    def close(self):
+        """Release any resources held by the store"""
+
+    def after_fork(self):
+        """Prepare a store inherited from a parent process for use in a child"""
+
+    def lock_wait_stats(self):
+        """{mode: (waits, seconds)} for the store's lock, or None if it has none"""
+        return None
+
+    def iter(self, field=None, descending=False, batch_size=500):
+        """Yield all posts in listing order, fetching them a page at a time
+
+        The lock is only held while a batch is read, so writers are not
+        blocked for the length of a long iteration. Posts written during the
+        iteration may or may not be included.
+        """
+        after = None
+        while True:
+            posts, after = self.page(field, descending, after, batch_size)
+            yield from posts
+            if after is None:
+                return
+
+
+class PostStore(BasePostStore):
+    """Keeps blog posts in memory in creation order with an id -> post index"""
+
+    def __init__(self, posts=None):
+        super().__init__()
+        # Dicts preserve insertion order, so one dict is both the id index
+        # and the creation-order list
+        self._posts = {}
+        # Sorted list of post IDs, for seeking to a page cursor
+        self._ids = []
+        # One sorted list of (casefolded value, id) pairs per sortable field
+        self._sorted = {field: [] for field in SORT_FIELDS}
+        self._search = SearchIndex()
+        for post in posts or []:
+            self._posts[post.id] = post
+            self._search.add(post)
+            for field in SORT_FIELDS:
+                self._sorted[field].append((post.key(field), post.id))
+        self._ids = sorted(self._posts)
+        for index in self._sorted.values():
+            index.sort()
+
+        # IDs are handed out by a counter that never goes backwards, so IDs of
+        # deleted posts are not reused
+        self._next_id = max(self._posts, default=0) + 1
+        # (version, modified_at), replaced as a whole on every write
+        self.generation = uuid.uuid4().hex
+        self._state = (0, time.time())
+        # Readers share the lock; writers get it exclusively. Posts are never
+        # modified in place (updates store a new Post), so a post handed out
+        # to a reader never changes under it.
+        self._lock = ReadWriteLock()
+
+    def __len__(self):
+        return len(self._posts)
+
+    def __contains__(self, post_id):
+        return post_id in self._posts
+
+    def lock_wait_stats(self):
+        return self._lock.wait_stats()
+
+    def version(self):
+        version, modified_at = self._state
+        return self.generation, version, modified_at
+
+    def _written(self, old_post, new_post):
+        """Bump the version and tell listeners (called with the write lock held)"""
+        version = self._state[0] + 1
+        self._state = (version, time.time())
+        self._notify(version, old_post, new_post)
+
+    def all(self):
+        """Return all posts in creation order"""
+        with self._lock.read():
+            return list(self._posts.values())
+
+    def get(self, post_id):
+        """Return the post with the given ID, or None"""
+        # A single dict lookup is atomic, so no lock is needed
+        return self._posts.get(post_id)
+
+    def sorted(self, field, descending=False):
+        """Return all posts ordered by a field, case-insensitively
+
+        Posts with equal values keep their creation order in both directions,
+        like a stable sort would.
+        """
+        with self._lock.read():
+            return [self._posts[post_id] for _, post_id in self._walk(field, descending)]
+
+    def page(self, field=None, descending=False, after=None, limit=100):
+        """Return one page of posts and the position to continue from
+
+        Without a field, posts are in creation order. `after` is the position
+        returned for the previous page: an ID, or a (sort key, ID) pair when
+        sorting. The returned position is None on the last page.
+        """
+        with self._lock.read():
+            if field is None:
+                start = 0 if after is None else bisect.bisect_right(self._ids, after)
+                page_ids = self._ids[start:start + limit + 1]
+                positions = page_ids
+            else:
+                positions = list(itertools.islice(self._walk(field, descending, after), limit + 1))
+                page_ids = [post_id for _, post_id in positions]
+
+            posts = [self._posts[post_id] for post_id in page_ids[:limit]]
+            next_position = positions[limit - 1] if len(positions) > limit else None
+            return posts, next_position
+
+    def _walk(self, field, descending=False, after=None):
+        """Yield (sort key, ID) pairs from a sorted index, starting past `after`"""
+        index = self._sorted[field]
+        if not descending:
+            start = 0 if after is None else bisect.bisect_right(index, tuple(after))
+            for position in range(start, len(index)):
+                yield index[position]
+            return
+
+        # Walk the index backwards one run of equal keys at a time, keeping
+        # each run in ascending ID order
+        end = len(index)
+        if after is not None:
+            key, post_id = after
+            start = bisect.bisect_left(index, (key,))
+            run_end = bisect.bisect_left(index, (key, math.inf))
+            yield from index[bisect.bisect_right(index, (key, post_id)):run_end]
+            end = start
+        while end:
+            key = index[end - 1][0]
+            start = bisect.bisect_left(index, (key,), 0, end)
+            yield from index[start:end]
+            end = start
+
+    def search(self, title=None, content=None, mode='substring'):
+        """Return posts matching the title query OR the content query
+
+        Results are in creation order.
+        """
+        with self._lock.read():
+            matching_ids = self._matching_ids(title, content, mode)
+            return [self._posts[post_id] for post_id in sorted(matching_ids)]
+
+    def search_page(self, title=None, content=None, mode='substring', after=None, limit=100):
+        """Return one page of search results and the ID to continue from
+
+        The returned ID is None on the last page.
+        """
+        with self._lock.read():
+            matching_ids = self._matching_ids(title, content, mode)
+            if after is not None:
+                matching_ids = [post_id for post_id in matching_ids if post_id > after]
+            page_ids = heapq.nsmallest(limit + 1, matching_ids)
+
+            posts = [self._posts[post_id] for post_id in page_ids[:limit]]
+            next_position = page_ids[limit - 1] if len(page_ids) > limit else None
+            return posts, next_position
+
+    def _matching_ids(self, title, content, mode):
+        matching_ids = set()
+        if title:
+            matching_ids |= self._search.search('title', title, mode)
+        if content:
+            matching_ids |= self._search.search('content', content, mode)
+        return matching_ids
+
+    def _index(self, post):
+        for field in SORT_FIELDS:
+            bisect.insort(self._sorted[field], (post.key(field), post.id))
+        self._search.add(post)
+
+    def _unindex(self, post):
+        for field in SORT_FIELDS:
+            index = self._sorted[field]
+            del index[bisect.bisect_left(index, (post.key(field), post.id))]
+        self._search.remove(post)
+
+    def create(self, title, content):
+        """Create a new post with a freshly allocated ID"""
+        with self._lock.write():
+            return self._put_all([Post(self._next_id, title, content)])[0]
+
+    def add(self, post):
+        """Store a new post"""
+        with self._lock.write():
+            return self._put_all([post])[0]
+
+    def update(self, post_id, title=None, content=None):
+        """Update a post (keep existing values if not provided)"""
+        return self.update_many([{"id": post_id, "title": title, "content": content}])[0]
+
+    def delete(self, post_id):
+        """Remove a post, returning it, or None if it does not exist"""
+        return self.delete_many([post_id])[0]
+
+    def create_many(self, items):
+        with self._lock.write():
+            return self._put_all([Post(self._next_id + offset, item['title'], item['content'])
+                                  for offset, item in enumerate(items)])
+
+    def update_many(self, items):
+        with self._lock.write():
+            # Later items for the same ID build on the earlier ones
+            updated = {}
+            posts = []
+            for item in items:
+                post = updated.get(item['id']) or self._posts.get(item['id'])
+                if post is not None:
+                    post = updated[post.id] = Post(
+                        post.id, item.get('title') or post.title, item.get('content') or post.content)
+                posts.append(post)
+            self._put_all([post for post in posts if post is not None])
+            return posts
+
+    def delete_many(self, post_ids):
+        with self._lock.write():
+            deleted = {}
+            posts = []
+            for post_id in post_ids:
+                post = None if post_id in deleted else self._posts.get(post_id)
+                if post is not None:
+                    deleted[post_id] = post
+                posts.append(post)
+            self._apply([(post_id, None) for post_id in deleted])
+            return posts
+
+    # The methods below expect the write lock to be held
+
+    def _put_all(self, posts):
+        # Check the whole batch first, so a bad post changes nothing
+        for post in posts:
+            check_post(post)
+        self._apply([(post.id, post) for post in posts])
+        return posts
+
+    def _apply(self, writes):
+        """Store or delete posts: a list of (ID, new post, or None to delete it)
+
+        Writes are checked before they get here and are applied in order.
+        Subclasses that persist writes record them here before calling this.
+        """
+        for post_id, post in writes:
+            old_post = self._posts.get(post_id)
+            if old_post is not None:
+                self._unindex(old_post)
+            if post is None:
+                del self._posts[post_id]
+                del self._ids[bisect.bisect_left(self._ids, post_id)]
+            else:
+                if old_post is None:
+                    bisect.insort(self._ids, post_id)
+                self._posts[post_id] = post
+                self._index(post)
+                if post_id >= self._next_id:
+                    self._next_id = post_id + 1
+            self._written(old_post, post)
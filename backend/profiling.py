@@ -0,0 +1,126 @@
+"""
+On-demand profiling of a running server
+"""
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+from flask import g, request
+
+# Limits of one profiling request
+MAX_SAMPLE_SECONDS = 60
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MAX_PROFILED_REQUESTS = 1000
+MAX_PROFILE_TIMEOUT = 300
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+    """Sample the stacks of all other threads for `seconds`
+
+    Returns the samples as collapsed stacks, one "thread;outer;...;inner count"
+    line per distinct stack, the input format of flamegraph.pl and speedscope.
+    Nothing runs between calls, so there is no cost while not sampling.
+    """
+    counts = collections.Counter()
+    sampler = threading.get_ident()
+    thread_names = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frames = sys._current_frames()
+        if frames.keys() - thread_names.keys():
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in frames.items():
+            if ident == sampler:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class _Session:
+    def __init__(self, route, count):
+        self.route = route
+        self.count = count
+        self.started = 0
+        self.profiles = []
+        self.done = threading.Event()
+
+
+class RequestProfiler:
+    """Profiles the next requests to one route with cProfile, on demand
+
+    While no profile is being taken, the request hooks only check a single
+    attribute, so leaving the profiler installed costs next to nothing.
+    """
+
+    def __init__(self, app=None):
+        self._session = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        session = self._session
+        if session is None or request.url_rule is None or request.url_rule.rule != session.route:
+            return
+        with self._lock:
+            if session.started >= session.count:
+                return
+            session.started += 1
+        profile = cProfile.Profile()
+        g.request_profile = (session, profile)
+        profile.enable()
+
+    def _finish(self, error=None):
+        entry = g.pop('request_profile', None)
+        if entry is None:
+            return
+        session, profile = entry
+        profile.disable()
+        with self._lock:
+            session.profiles.append(profile)
+            if len(session.profiles) >= session.count:
+                session.done.set()
+
+    def profile(self, route, count, timeout):
+        """Profile the next `count` requests to a URL rule, waiting at most `timeout` seconds
+
+        Returns (pstats.Stats, number of requests profiled), or (None, 0) if
+        no request arrived in time. Raises RuntimeError if another profile
+        is being taken.
+        """
+        session = _Session(route, count)
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("Another profile is being taken. Try again when it has finished.")
+            self._session = session
+        try:
+            session.done.wait(timeout)
+        finally:
+            with self._lock:
+                self._session = None
+                profiles = list(session.profiles)
+        if not profiles:
+            return None, 0
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats, len(profiles)
@@ -0,0 +1,180 @@
+"""
+Cache of serialized listing and search responses
+"""
+import collections
+import json
+import threading
+
+from search_index import SEARCH_FIELDS, normalized_text_matches
+
+# Default size limit of the in-process cache
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def search_dependency(title, content, mode):
+    """Dependency of a cached search response: the query it answers"""
+    return {"title": title, "content": content, "mode": mode}
+
+
+def is_affected(dependency, post):
+    """Whether a cached response may change because of a post before/after a write
+
+    A dependency of None stands for listings, which depend on every post.
+    Search responses only depend on the posts that match their query.
+    """
+    if dependency is None:
+        return True
+    if post is None:
+        return False
+    return any(dependency[field] and normalized_text_matches(post.key(field), dependency[field], dependency['mode'])
+               for field in SEARCH_FIELDS)
+
+
+class LocalCacheBackend:
+    """In-process LRU of response bodies, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key -> (body, dependency)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, body, dependency):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._bytes -= len(old_entry[0])
+            self._entries[key] = (body, dependency)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (evicted_body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_body)
+                self.evictions += 1
+
+    def invalidate(self, should_drop):
+        """Drop the entries whose dependency satisfies should_drop; returns how many"""
+        with self._lock:
+            keys = [key for key, (_, dependency) in self._entries.items() if should_drop(dependency)]
+            for key in keys:
+                body, _ = self._entries.pop(key)
+                self._bytes -= len(body)
+        return len(keys)
+
+    def size(self):
+        """(number of entries, total bytes)"""
+        with self._lock:
+            return len(self._entries), self._bytes
+
+
+class RedisCacheBackend:
+    """Cache shared by several worker processes through Redis
+
+    Bodies are stored under their own keys with a TTL, and the dependency of
+    every entry in one hash, so any worker can invalidate entries written by
+    another. Size limits and LRU eviction are left to the Redis server
+    (maxmemory with the allkeys-lru policy).
+    """
+
+    def __init__(self, client, prefix='blog:cache:', ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.evictions = 0
+        self._dependencies_key = prefix + 'dependencies'
+
+    def _body_key(self, key):
+        return self.prefix + 'body:' + key
+
+    def get(self, key):
+        return self.client.get(self._body_key(key))
+
+    def set(self, key, body, dependency):
+        self.client.set(self._body_key(key), body, ex=self.ttl)
+        self.client.hset(self._dependencies_key, key, json.dumps(dependency))
+
+    def invalidate(self, should_drop):
+        keys = []
+        for key, dependency in self.client.hgetall(self._dependencies_key).items():
+            if isinstance(key, bytes):
+                key = key.decode('utf-8')
+            if should_drop(json.loads(dependency)):
+                keys.append(key)
+        if keys:
+            self.client.delete(*[self._body_key(key) for key in keys])
+            self.client.hdel(self._dependencies_key, *keys)
+        return len(keys)
+
+    def size(self):
+        return len(self.client.hgetall(self._dependencies_key)), None
+
+
+class ResponseCache:
+    """Serialized responses keyed by normalized query parameters
+
+    Register post_written() as a store listener: every write drops exactly
+    the entries it can affect. A response built while a write happened is
+    not stored (see token()), so a stale body can't outlive its invalidation.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._writes = 0
+
+    def get(self, key):
+        body = self.backend.get(key)
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def token(self):
+        """Take before building a response; pass to put()"""
+        return self._writes
+
+    def put(self, key, body, dependency, token):
+        if token == self._writes:
+            self.backend.set(key, body, dependency)
+
+    def post_written(self, version, old_post, new_post):
+        self._writes += 1
+        self.invalidations += self.backend.invalidate(
+            lambda dependency: is_affected(dependency, old_post) or is_affected(dependency, new_post))
+
+    def stats(self):
+        entries, size = self.backend.size()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+def open_cache(url=None, max_bytes=DEFAULT_CACHE_BYTES):
+    """Create a response cache; `url` is a redis:// URL for a shared cache"""
+    if not url:
+        return ResponseCache(LocalCacheBackend(max_bytes))
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A shared response cache needs the 'redis' package: pip install redis") from None
+        return ResponseCache(RedisCacheBackend(redis.Redis.from_url(url)))
+    raise ValueError(f"Unknown response cache '{url}'. Use a redis:// URL.")
@@ -0,0 +1,69 @@
+"""
+Readers-writer lock for the in-memory post store
+"""
+import contextlib
+import threading
+import time
+
+
+class ReadWriteLock:
+    """Lets any number of readers in at once, or a single writer
+
+    Waiting writers take priority over new readers, so a steady stream of
+    reads can't starve writes. Acquisitions that had to wait are counted,
+    with the time spent waiting (see wait_stats()).
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._waits = {'read': [0, 0.0], 'write': [0, 0.0]}  # mode -> [waits, seconds]
+
+    def wait_stats(self):
+        """{'read': (waits, seconds), 'write': (waits, seconds)} since the lock was created"""
+        with self._condition:
+            return {mode: tuple(stats) for mode, stats in self._waits.items()}
+
+    def _record_wait(self, mode, started):
+        stats = self._waits[mode]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def read(self):
+        with self._condition:
+            if self._writer or self._waiting_writers:
+                started = time.perf_counter()
+                while self._writer or self._waiting_writers:
+                    self._condition.wait()
+                self._record_wait('read', started)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                if self._writer or self._readers:
+                    started = time.perf_counter()
+                    while self._writer or self._readers:
+                        self._condition.wait()
+                    self._record_wait('write', started)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
@@ -0,0 +1,185 @@
+"""
+Inverted indexes for searching blog posts by title and content
+"""
+import bisect
+import re
+
+# Fields that are indexed for search
+SEARCH_FIELDS = ('title', 'content')
+
+# Supported search modes:
+# - substring: case-insensitive substring match (the original search behavior)
+# - all: every term must appear as a word (a trailing * matches a word prefix)
+# - any: at least one term must appear as a word
+SEARCH_MODES = ('substring', 'all', 'any')
+
+# Longest n-gram kept for substring search
+NGRAM_SIZE = 3
+
+TOKEN_PATTERN = re.compile(r'\w+')
+QUERY_TERM_PATTERN = re.compile(r'\w+\*?')
+
+
+def normalize(text):
+    """Case-insensitive form of a string used for matching"""
+    return text.casefold()
+
+
+def tokenize(text):
+    """Split normalized text into word tokens"""
+    return TOKEN_PATTERN.findall(text)
+
+
+def ngrams(text):
+    """All distinct substrings of a text that are 1 to NGRAM_SIZE characters long"""
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        for start in range(len(text) - size + 1):
+            grams.add(text[start:start + size])
+    return grams
+
+
+def text_matches(text, query, mode='substring'):
+    """Whether one text matches a query, by the same rules as the indexes"""
+    return normalized_text_matches(normalize(text), query, mode)
+
+
+def normalized_text_matches(text, query, mode='substring'):
+    """Like text_matches() for a text that is already normalized"""
+    query = normalize(query)
+    if mode == 'substring':
+        return query in text
+
+    terms = QUERY_TERM_PATTERN.findall(query)
+    if not terms:
+        return False
+    words = set(tokenize(text))
+
+    def has_term(term):
+        if term.endswith('*'):
+            prefix = term.rstrip('*')
+            return any(word.startswith(prefix) for word in words)
+        return term in words
+
+    matches = (has_term(term) for term in terms)
+    return all(matches) if mode == 'all' else any(matches)
+
+
+def _add_posting(postings, key, post_id):
+    ids = postings.get(key)
+    if ids is None:
+        postings[key] = ids = set()
+    ids.add(post_id)
+
+
+def _remove_posting(postings, key, post_id):
+    ids = postings.get(key)
+    if ids is not None:
+        ids.discard(post_id)
+        if not ids:
+            del postings[key]
+            return True
+    return False
+
+
+class FieldIndex:
+    """Word and n-gram postings for a single text field"""
+
+    def __init__(self):
+        self._texts = {}  # post id -> normalized text
+        self._words = {}  # word -> set of post ids
+        self._vocabulary = []  # sorted list of words, for prefix lookups
+        self._grams = {}  # n-gram -> set of post ids
+
+    def add(self, post_id, text):
+        """Index a normalized text"""
+        self._texts[post_id] = text
+        for word in set(tokenize(text)):
+            if word not in self._words:
+                bisect.insort(self._vocabulary, word)
+            _add_posting(self._words, word, post_id)
+        for gram in ngrams(text):
+            _add_posting(self._grams, gram, post_id)
+
+    def remove(self, post_id):
+        text = self._texts.pop(post_id, None)
+        if text is None:
+            return
+        for word in set(tokenize(text)):
+            if _remove_posting(self._words, word, post_id):
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+        for gram in ngrams(text):
+            _remove_posting(self._grams, gram, post_id)
+
+    def substring(self, query):
+        """IDs of posts whose text contains the query"""
+        query = normalize(query)
+        if len(query) <= NGRAM_SIZE:
+            return set(self._grams.get(query, ()))
+
+        # Every trigram of the query has to appear in a matching text, so the
+        # intersection of their postings is a small candidate set to verify
+        postings = [self._grams.get(query[i:i + NGRAM_SIZE])
+                    for i in range(len(query) - NGRAM_SIZE + 1)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                break
+        return {post_id for post_id in candidates if query in self._texts[post_id]}
+
+    def term(self, term):
+        """IDs of posts containing a word, or a word prefix if it ends with *"""
+        if not term.endswith('*'):
+            return self._words.get(term, set())
+
+        prefix = term.rstrip('*')
+        ids = set()
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for word in self._vocabulary[start:]:
+            if not word.startswith(prefix):
+                break
+            ids |= self._words[word]
+        return ids
+
+    def terms(self, query, match_all):
+        """IDs of posts matching all (or any) of the words in a query"""
+        terms = QUERY_TERM_PATTERN.findall(normalize(query))
+        if not terms:
+            return set()
+
+        postings = [self.term(term) for term in terms]
+        if not match_all:
+            return set().union(*postings)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+
+class SearchIndex:
+    """Separate inverted indexes for post titles and contents"""
+
+    def __init__(self):
+        self._fields = {field: FieldIndex() for field in SEARCH_FIELDS}
+
+    def add(self, post):
+        for field, index in self._fields.items():
+            index.add(post.id, post.key(field))
+
+    def remove(self, post):
+        for index in self._fields.values():
+            index.remove(post.id)
+
+    def search(self, field, query, mode='substring'):
+        """IDs of posts whose field matches the query in the given mode"""
+        index = self._fields[field]
+        if mode == 'substring':
+            return index.substring(query)
+        return index.terms(query, match_all=(mode == 'all'))
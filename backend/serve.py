@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the blog API
+
+    python backend/serve.py --workers 4 --threads 8 --preload --store sqlite:///blog.db
+
+Binds one listening socket and forks worker processes that all accept on it.
+Each worker serves requests from a bounded thread pool. The in-memory post
+store lives inside a single process, so more than one worker requires a
+store that all workers share (SQLite); the launcher refuses to start
+otherwise instead of silently giving every worker its own copy of the data.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from storage import DEFAULT_STORE_URL, is_shared
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server answering requests on a fixed-size thread pool"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='blog-request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the blog API with several worker processes")
+    parser.add_argument('--bind', default='0.0.0.0:5002', help="host:port to listen on (default 0.0.0.0:5002)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument('--threads', type=int, default=8, help="request threads per worker (default 8)")
+    parser.add_argument('--preload', action='store_true',
+                        help="import the app (and open the store) once before forking the workers")
+    parser.add_argument('--store', default=os.environ.get('BLOG_STORE', DEFAULT_STORE_URL),
+                        help="post store URL (default: $BLOG_STORE or 'memory')")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.threads < 1:
+        parser.error("--workers and --threads must be at least 1")
+    if args.workers > 1 and not is_shared(args.store):
+        parser.error(f"--workers {args.workers} needs a store shared between processes, but '{args.store}' "
+                     "lives inside one process. Use --store sqlite:///path/to/blog.db or --workers 1.")
+    return args
+
+
+def load_app():
+    import backend_app
+    return backend_app
+
+
+def run_worker(listener, host, port, threads, backend_app):
+    """Serve requests in a forked worker process until it is told to stop"""
+    if backend_app is None:
+        backend_app = load_app()
+    else:
+        backend_app.POSTS.after_fork()
+
+    # Ctrl+C reaches the whole process group; the launcher stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = PooledWSGIServer(host, port, backend_app.app, threads, fd=listener.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.pool.shutdown(wait=False)
+        backend_app.POSTS.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    host, _, port = args.bind.rpartition(':')
+    port = int(port)
+    os.environ['BLOG_STORE'] = args.store
+
+    # Per-process response caches would not see writes made by other
+    # workers, so only a shared cache may be used with several workers
+    if args.workers > 1 and not os.environ.get('BLOG_CACHE_URL'):
+        os.environ['BLOG_CACHE_BYTES'] = '0'
+
+    listener = socket.create_server((host or '0.0.0.0', port), backlog=2048, reuse_port=False)
+    listener.set_inheritable(True)
+    backend_app = load_app() if args.preload else None
+
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(listener, host, port, args.threads, backend_app)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    print(f"Serving on http://{host or '0.0.0.0'}:{port} with {args.workers} workers x {args.threads} threads")
+
+    # Replace workers that die
+    while True:
+        pid, _ = os.wait()
+        if pid in children:
+            children.discard(pid)
+            spawn()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+SQLite storage for blog posts
+"""
+import contextlib
+import sqlite3
+import threading
+import time
+import uuid
+
+from post import Post
+from post_store import SORT_FIELDS, BasePostStore, check_post
+from search_index import QUERY_TERM_PATTERN, normalize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    content_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_title_key ON posts (title_key, id);
+CREATE INDEX IF NOT EXISTS posts_content_key ON posts (content_key, id);
+
+-- A single row with the data set's generation and write version
+CREATE TABLE IF NOT EXISTS store_meta (
+    generation TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    modified_at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS posts_version_after_insert AFTER INSERT ON posts BEGIN
+    UPDATE store_meta SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+CREATE TRIGGER IF NOT EXISTS posts_version_after_update AFTER UPDATE ON posts BEGIN
+    UPDATE store_meta SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+CREATE TRIGGER IF NOT EXISTS posts_version_after_delete AFTER DELETE ON posts BEGIN
+    UPDATE store_meta SET version = version + 1, modified_at = (julianday('now') - 2440587.5) * 86400.0;
+END;
+
+-- Word index for the 'all' and 'any' search modes
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_words USING fts5(
+    title_key, content_key, content='posts', content_rowid='id',
+    tokenize="unicode61 remove_diacritics 0 tokenchars '_'"
+);
+-- Trigram index for the 'substring' search mode
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_trigrams USING fts5(
+    title_key, content_key, content='posts', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS posts_after_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_words (rowid, title_key, content_key) VALUES (new.id, new.title_key, new.content_key);
+    INSERT INTO posts_trigrams (rowid, title_key, content_key) VALUES (new.id, new.title_key, new.content_key);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_after_delete AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_words (posts_words, rowid, title_key, content_key)
+        VALUES ('delete', old.id, old.title_key, old.content_key);
+    INSERT INTO posts_trigrams (posts_trigrams, rowid, title_key, content_key)
+        VALUES ('delete', old.id, old.title_key, old.content_key);
+END;
+CREATE TRIGGER IF NOT EXISTS posts_after_update AFTER UPDATE ON posts BEGIN
+    INSERT INTO posts_words (posts_words, rowid, title_key, content_key)
+        VALUES ('delete', old.id, old.title_key, old.content_key);
+    INSERT INTO posts_trigrams (posts_trigrams, rowid, title_key, content_key)
+        VALUES ('delete', old.id, old.title_key, old.content_key);
+    INSERT INTO posts_words (rowid, title_key, content_key) VALUES (new.id, new.title_key, new.content_key);
+    INSERT INTO posts_trigrams (rowid, title_key, content_key) VALUES (new.id, new.title_key, new.content_key);
+END;
+"""
+
+SELECT_VERSION = "SELECT generation, version, modified_at FROM store_meta"
+INSERT_VERSION = (
+    "INSERT INTO store_meta (generation, version, modified_at)"
+    " SELECT ?, 0, ? WHERE NOT EXISTS (SELECT 1 FROM store_meta)"
+)
+SELECT_POST = "SELECT id, title, content FROM posts WHERE id = ?"
+SELECT_ALL = "SELECT id, title, content FROM posts ORDER BY id"
+SELECT_PAGE = "SELECT id, title, content FROM posts WHERE id > ? ORDER BY id LIMIT ?"
+INSERT_POST = "INSERT INTO posts (title, content, title_key, content_key) VALUES (?, ?, ?, ?)"
+INSERT_SEED_POST = (
+    "INSERT OR IGNORE INTO posts (id, title, content, title_key, content_key) VALUES (?, ?, ?, ?, ?)"
+)
+INSERT_POST_WITH_ID = "INSERT INTO posts (id, title, content, title_key, content_key) VALUES (?, ?, ?, ?, ?)"
+UPDATE_POST = "UPDATE posts SET title = ?, content = ?, title_key = ?, content_key = ? WHERE id = ?"
+DELETE_POST = "DELETE FROM posts WHERE id = ?"
+
+# Sorted reads per field; column names come from SORT_FIELDS, never from a request.
+# Descending order keeps equal values in ascending ID order, like the in-memory store.
+SELECT_SORTED = {}
+SELECT_SORTED_FIRST_PAGE = {}
+SELECT_SORTED_PAGE = {}
+for field in SORT_FIELDS:
+    for descending in (False, True):
+        order = f"ORDER BY {field}_key {'DESC' if descending else 'ASC'}, id"
+        SELECT_SORTED[field, descending] = f"SELECT id, title, content FROM posts {order}"
+        SELECT_SORTED_FIRST_PAGE[field, descending] = (
+            f"SELECT id, title, content, {field}_key FROM posts {order} LIMIT ?")
+    SELECT_SORTED_PAGE[field, False] = (
+        f"SELECT id, title, content, {field}_key FROM posts"
+        f" WHERE ({field}_key, id) > (?, ?) ORDER BY {field}_key, id LIMIT ?")
+    SELECT_SORTED_PAGE[field, True] = (
+        f"SELECT id, title, content, {field}_key FROM posts"
+        f" WHERE {field}_key < ? OR ({field}_key = ? AND id > ?) ORDER BY {field}_key DESC, id LIMIT ?")
+
+# Subqueries returning the IDs of matching posts for one field. The FTS match
+# narrows down the candidates; for substring search instr() on the casefolded
+# column confirms each one.
+SEARCH_WORDS = "SELECT rowid FROM posts_words WHERE posts_words MATCH ?"
+SEARCH_TRIGRAMS = "SELECT rowid FROM posts_trigrams WHERE posts_trigrams MATCH ? AND instr({column}, ?) > 0"
+SEARCH_SHORT_SUBSTRING = "SELECT id FROM posts WHERE instr({column}, ?) > 0"
+SELECT_SEARCH_PAGE = "SELECT id, title, content FROM posts WHERE id IN ({matches}) AND id > ? ORDER BY id LIMIT ?"
+
+
+def _row_to_post(row):
+    return Post(row[0], row[1], row[2])
+
+
+def _fts_string(text):
+    """Quote text as an FTS5 string literal"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+class SQLitePostStore(BasePostStore):
+    """Keeps blog posts in a SQLite database
+
+    Each thread gets its own connection. The database runs in WAL mode so
+    readers don't block the writer, and sqlite3's statement cache reuses the
+    prepared form of the fixed queries above.
+    """
+
+    def __init__(self, path, posts=None):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        connection = self._connection()
+        created = connection.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'posts'"
+        ).fetchone()[0] == 0
+        connection.executescript(SCHEMA)
+        connection.execute(INSERT_VERSION, (uuid.uuid4().hex, time.time()))
+
+        # Seed posts are only added to a brand new database. Worker processes
+        # starting together may all see it as new, so existing IDs are skipped.
+        if created and posts:
+            with self._transaction() as connection:
+                for post in posts:
+                    connection.execute(INSERT_SEED_POST, (
+                        post.id, post.title, post.content, post.title_key, post.content_key))
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; writes open their own transactions
+            connection = sqlite3.connect(
+                self.path, isolation_level=None, cached_statements=256, check_same_thread=False)
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run a block of statements as one write transaction
+
+        Writes made in the block are recorded with _written() and passed on
+        to the listeners once the transaction has committed.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        self._local.events = []
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        for event in self._local.events:
+            self._notify(*event)
+
+    def _written(self, connection, old_post, new_post):
+        if self._listeners:
+            version = connection.execute(SELECT_VERSION).fetchone()[1]
+            self._local.events.append((version, old_post, new_post))
+
+    def after_fork(self):
+        # SQLite connections must not be used across fork(); forget the
+        # parent's connections without closing them and open new ones lazily
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM posts").fetchone()[0]
+
+    def version(self):
+        return tuple(self._connection().execute(SELECT_VERSION).fetchone())
+
+    def all(self):
+        return [_row_to_post(row) for row in self._connection().execute(SELECT_ALL)]
+
+    def get(self, post_id):
+        row = self._connection().execute(SELECT_POST, (post_id,)).fetchone()
+        return _row_to_post(row) if row else None
+
+    def sorted(self, field, descending=False):
+        rows = self._connection().execute(SELECT_SORTED[field, descending])
+        return [_row_to_post(row) for row in rows]
+
+    def page(self, field=None, descending=False, after=None, limit=100):
+        connection = self._connection()
+        if field is None:
+            rows = connection.execute(SELECT_PAGE, (after or 0, limit + 1)).fetchall()
+        elif after is None:
+            rows = connection.execute(SELECT_SORTED_FIRST_PAGE[field, descending], (limit + 1,)).fetchall()
+        elif descending:
+            key, post_id = after
+            rows = connection.execute(SELECT_SORTED_PAGE[field, True], (key, key, post_id, limit + 1)).fetchall()
+        else:
+            key, post_id = after
+            rows = connection.execute(SELECT_SORTED_PAGE[field, False], (key, post_id, limit + 1)).fetchall()
+
+        posts = [_row_to_post(row) for row in rows[:limit]]
+        next_position = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_position = last[0] if field is None else (last[3], last[0])
+        return posts, next_position
+
+    def search(self, title=None, content=None, mode='substring'):
+        posts, _ = self.search_page(title, content, mode, limit=-1)
+        return posts
+
+    def search_page(self, title=None, content=None, mode='substring', after=None, limit=100):
+        subqueries, params = [], []
+        for column, query in (('title_key', title), ('content_key', content)):
+            if query:
+                subquery, subquery_params = self._search_subquery(column, query, mode)
+                subqueries.append(subquery)
+                params.extend(subquery_params)
+        if not subqueries:
+            return [], None
+
+        # A negative limit means no limit in SQLite
+        sql = SELECT_SEARCH_PAGE.format(matches=' UNION '.join(subqueries))
+        rows = self._connection().execute(sql, (*params, after or 0, limit + 1 if limit >= 0 else -1)).fetchall()
+        if limit < 0:
+            return [_row_to_post(row) for row in rows], None
+
+        posts = [_row_to_post(row) for row in rows[:limit]]
+        next_position = rows[limit - 1][0] if len(rows) > limit else None
+        return posts, next_position
+
+    def _search_subquery(self, column, query, mode):
+        """SQL and parameters selecting the IDs of posts whose column matches"""
+        query = normalize(query)
+        if mode == 'substring':
+            # The trigram tokenizer can only match queries of 3+ characters
+            if len(query) < 3:
+                return SEARCH_SHORT_SUBSTRING.format(column=column), [query]
+            return SEARCH_TRIGRAMS.format(column=column), [f"{column} : {_fts_string(query)}", query]
+
+        terms = QUERY_TERM_PATTERN.findall(query)
+        if not terms:
+            return "SELECT NULL WHERE 0", []
+        operator = ' AND ' if mode == 'all' else ' OR '
+        expression = operator.join(
+            _fts_string(term.rstrip('*')) + ('*' if term.endswith('*') else '') for term in terms)
+        return SEARCH_WORDS, [f"{column} : ({expression})"]
+
+    def _insert(self, connection, post):
+        check_post(post)
+        connection.execute(INSERT_POST_WITH_ID, (
+            post.id, post.title, post.content, post.title_key, post.content_key))
+        self._written(connection, None, post)
+        return post
+
+    def _create(self, connection, title, content):
+        post = Post(None, title, content)
+        check_post(post)
+        cursor = connection.execute(INSERT_POST, (title, content, post.title_key, post.content_key))
+        post = Post(cursor.lastrowid, title, content)
+        self._written(connection, None, post)
+        return post
+
+    def create(self, title, content):
+        with self._transaction() as connection:
+            return self._create(connection, title, content)
+
+    def add(self, post):
+        with self._transaction() as connection:
+            return self._insert(connection, post)
+
+    def update(self, post_id, title=None, content=None):
+        with self._transaction() as connection:
+            return self._update(connection, post_id, title, content)
+
+    def delete(self, post_id):
+        with self._transaction() as connection:
+            return self._delete(connection, post_id)
+
+    def create_many(self, items):
+        with self._transaction() as connection:
+            return [self._create(connection, item['title'], item['content']) for item in items]
+
+    def update_many(self, items):
+        with self._transaction() as connection:
+            return [self._update(connection, item['id'], item.get('title'), item.get('content'))
+                    for item in items]
+
+    def delete_many(self, post_ids):
+        with self._transaction() as connection:
+            return [self._delete(connection, post_id) for post_id in post_ids]
+
+    def _update(self, connection, post_id, title, content):
+        row = connection.execute(SELECT_POST, (post_id,)).fetchone()
+        if row is None:
+            return None
+        old_post = _row_to_post(row)
+        post = Post(post_id, title or old_post.title, content or old_post.content)
+        check_post(post)
+        connection.execute(UPDATE_POST, (
+            post.title, post.content, post.title_key, post.content_key, post_id))
+        self._written(connection, old_post, post)
+        return post
+
+    def _delete(self, connection, post_id):
+        row = connection.execute(SELECT_POST, (post_id,)).fetchone()
+        if row is None:
+            return None
+        connection.execute(DELETE_POST, (post_id,))
+        post = _row_to_post(row)
+        self._written(connection, post, None)
+        return post
@@ -0,0 +1,43 @@
+"""
+Choosing and opening a post store
+"""
+from urllib.parse import parse_qs, urlsplit
+
+from post import Post
+from post_journal import DEFAULT_FSYNC_INTERVAL, DEFAULT_SNAPSHOT_EVERY, JournaledPostStore
+from post_store import PostStore
+from sqlite_store import SQLitePostStore
+
+# Store used when BLOG_STORE is not set
+DEFAULT_STORE_URL = 'memory'
+
+
+def open_store(url=DEFAULT_STORE_URL, posts=None):
+    """Open the post store described by a URL
+
+    - 'memory': in-memory store (lost on restart)
+    - 'memory:///path/to/blog.log': in-memory store with a write-ahead log and
+      snapshots next to it; `?fsync=<seconds>` sets the group commit interval
+      (0 = fsync every write) and `?snapshot_every=<writes>` the compaction interval
+    - 'sqlite:///path/to/blog.db': SQLite database file
+
+    `posts` are seed posts (dicts or Posts) for a store that starts out empty.
+    """
+    posts = [Post.from_dict(post) for post in posts or []]
+    if url == 'memory':
+        return PostStore(posts)
+    if url.startswith('memory:///'):
+        parts = urlsplit(url)
+        options = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        return JournaledPostStore(
+            parts.path, posts,
+            fsync_interval=float(options.get('fsync', DEFAULT_FSYNC_INTERVAL)),
+            snapshot_every=int(options.get('snapshot_every', DEFAULT_SNAPSHOT_EVERY)))
+    if url.startswith('sqlite:///'):
+        return SQLitePostStore(url[len('sqlite:///'):], posts)
+    raise ValueError(f"Unknown post store '{url}'. Use 'memory', 'memory:///path/to/blog.log' or 'sqlite:///path/to/blog.db'.")
+
+
+def is_shared(url):
+    """Whether several processes can open the store at `url` and see each other's writes"""
+    return url.startswith('sqlite:///')
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Load test of the blog API: throughput and latency of a mix of requests
+
+    python benchmarks/load.py --posts 10000 --content-size 500 --concurrency 8 --duration 10
+    python benchmarks/load.py --url http://localhost:5002 --server-pid 1234 --posts 100000
+
+Seeds the given number of generated posts, then runs `--concurrency` threads
+that send a weighted mix of listing, sorted listing, search, create, update
+and delete requests for `--duration` seconds (or `--requests` in total).
+Requests go through the Flask test client in this process, or to a running
+server with `--url`. Posts, queries and the request mix are generated from
+`--seed`, so runs with the same arguments send the same requests.
+
+Prints a JSON report with requests per second, p50/p95/p99 latency per
+request type and the peak RSS of the process serving the requests.
+"""
+import argparse
+import functools
+import http.client
+import itertools
+import json
+import os
+import random
+import resource
+import string
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+OPERATIONS = ('get', 'sorted', 'search', 'post', 'put', 'delete')
+DEFAULT_MIX = 'get=30,sorted=20,search=30,post=10,put=5,delete=5'
+# Posts per request while seeding
+SEED_BATCH_SIZE = 1000
+
+
+def parse_mix(text):
+    """'get=30,search=70' -> {'get': 30.0, 'search': 70.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}'. Valid options are: {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The request mix needs at least one operation with a positive weight")
+    return mix
+
+
+class TextGenerator:
+    """Deterministic pseudo-text built from a fixed vocabulary"""
+
+    def __init__(self, seed, vocabulary_size=5000):
+        rng = random.Random(seed)
+        self.words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+                      for _ in range(vocabulary_size)]
+
+    def text(self, rng, size):
+        words, length = [], 0
+        while length < size:
+            word = rng.choice(self.words)
+            words.append(word)
+            length += len(word) + 1
+        return ' '.join(words)[:size].strip() or 'x'
+
+    def query(self, rng):
+        """A search term: a whole word or, sometimes, part of one"""
+        word = rng.choice(self.words)
+        return word if rng.random() < 0.7 else word[:3]
+
+
+class LiveIds:
+    """IDs of the posts created by the benchmark, shared by all threads"""
+
+    def __init__(self):
+        self._ids = []
+        self._lock = threading.Lock()
+
+    def add(self, post_id):
+        with self._lock:
+            self._ids.append(post_id)
+
+    def pick(self, rng):
+        with self._lock:
+            return rng.choice(self._ids) if self._ids else None
+
+    def take(self, rng):
+        """Remove and return a random ID (swapped with the last one to keep removal O(1))"""
+        with self._lock:
+            if not self._ids:
+                return None
+            position = rng.randrange(len(self._ids))
+            self._ids[position], self._ids[-1] = self._ids[-1], self._ids[position]
+            return self._ids.pop()
+
+
+class InProcessClient:
+    """Sends requests through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """Sends requests to a running server over one keep-alive connection"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        data, headers = None, {}
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # Count it as a failed request and reconnect for the next one
+            self.connection.close()
+            self.connection = None
+            return 0, b''
+
+
+def in_process_app(store_url):
+    """The Flask app, on a fresh store opened from `store_url`"""
+    os.environ['BLOG_STORE'] = store_url
+    sys.path.insert(0, os.path.join(REPO_DIR, 'backend'))
+    import backend_app
+    return backend_app.app
+
+
+def seed(client, generator, rng, count, title_size, content_size, live_ids):
+    """Create `count` posts through the bulk endpoint"""
+    for start in range(0, count, SEED_BATCH_SIZE):
+        batch = [{"title": generator.text(rng, title_size), "content": generator.text(rng, content_size)}
+                 for _ in range(min(SEED_BATCH_SIZE, count - start))]
+        status, body = client.request('POST', '/api/posts/bulk', batch)
+        if status != 201:
+            raise SystemExit(f"Seeding failed with status {status}: {body[:200]!r}")
+        for result in json.loads(body)['results']:
+            live_ids.add(result['post']['id'])
+
+
+def make_request(operation, rng, generator, args, live_ids):
+    """(method, path, body) for one request of the given type"""
+    limit = f"limit={args.limit}" if args.limit else ''
+    if operation == 'get':
+        return 'GET', '/api/posts' + (f"?{limit}" if limit else ''), None
+    if operation == 'sorted':
+        query = f"sort={rng.choice(('title', 'content'))}&direction={rng.choice(('asc', 'desc'))}"
+        return 'GET', f"/api/posts?{query}" + (f"&{limit}" if limit else ''), None
+    if operation == 'search':
+        field = rng.choice(('title', 'content'))
+        query = f"{field}={quote(generator.query(rng))}&mode={rng.choice(args.search_modes)}"
+        return 'GET', f"/api/posts/search?{query}" + (f"&{limit}" if limit else ''), None
+    if operation == 'post':
+        body = {"title": generator.text(rng, args.title_size), "content": generator.text(rng, args.content_size)}
+        return 'POST', '/api/posts', body
+    if operation == 'put':
+        post_id = live_ids.pick(rng) or 1
+        return 'PUT', f"/api/posts/{post_id}", {"title": generator.text(rng, args.title_size)}
+    post_id = live_ids.take(rng) or 1
+    return 'DELETE', f"/api/posts/{post_id}", None
+
+
+def run_worker(index, client, generator, args, live_ids, deadline, issued, results):
+    rng = random.Random(args.seed * 1000 + index)
+    operations, weights = zip(*args.mix.items())
+    latencies = {operation: [] for operation in operations}
+    statuses = {operation: Counter() for operation in operations}
+    sizes = Counter()
+    while time.perf_counter() < deadline and (args.requests is None or next(issued) < args.requests):
+        operation = rng.choices(operations, weights)[0]
+        method, path, body = make_request(operation, rng, generator, args, live_ids)
+        started = time.perf_counter()
+        status, response_body = client.request(method, path, body)
+        latencies[operation].append(time.perf_counter() - started)
+        statuses[operation][status] += 1
+        sizes[operation] += len(response_body)
+        if operation == 'post' and status == 201:
+            live_ids.add(json.loads(response_body)['id'])
+    results[index] = (latencies, statuses, sizes)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, statuses, sizes, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def milliseconds(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        "requests": count,
+        "requests_per_second": round(count / elapsed, 1),
+        "statuses": {str(status): number for status, number in sorted(statuses.items())},
+        "latency_ms": {
+            "mean": milliseconds(sum(latencies) / count if count else None),
+            "p50": milliseconds(percentile(latencies, 0.50)),
+            "p95": milliseconds(percentile(latencies, 0.95)),
+            "p99": milliseconds(percentile(latencies, 0.99)),
+            "max": milliseconds(latencies[-1] if latencies else None),
+        },
+        "mean_response_bytes": round(sizes / count) if count else None,
+    }
+
+
+def peak_rss(pid=None):
+    """Peak resident set size in bytes of this process, or of a server process on Linux"""
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        with open(f"/proc/{pid}/status", encoding='ascii') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the blog API and report latency and throughput as JSON")
+    parser.add_argument('--url', help="base URL of a running server (default: serve in this process)")
+    parser.add_argument('--store', default='memory', help="store URL when serving in this process (default 'memory')")
+    parser.add_argument('--server-pid', type=int, help="PID of the server process, to report its peak RSS")
+    parser.add_argument('--posts', type=int, default=10000, help="posts to seed (default 10000)")
+    parser.add_argument('--title-size', type=int, default=40, help="characters per title (default 40)")
+    parser.add_argument('--content-size', type=int, default=500, help="characters per content (default 500)")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent client threads (default 8)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to run (default 10)")
+    parser.add_argument('--requests', type=int, help="stop after this many requests instead")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weights of the request types (default {DEFAULT_MIX})")
+    parser.add_argument('--search-modes', type=lambda text: text.split(','), default=['substring', 'all'],
+                        help="search modes to use, comma separated (default substring,all)")
+    parser.add_argument('--limit', type=int, help="request pages of this size instead of whole listings")
+    parser.add_argument('--seed', type=int, default=1, help="random seed (default 1)")
+    parser.add_argument('--output', help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.url:
+        make_client = functools.partial(HttpClient, args.url)
+    else:
+        make_client = functools.partial(InProcessClient, in_process_app(args.store))
+
+    generator = TextGenerator(args.seed)
+    live_ids = LiveIds()
+    seed_started = time.perf_counter()
+    seed(make_client(), generator, random.Random(args.seed), args.posts, args.title_size, args.content_size, live_ids)
+    seed_seconds = time.perf_counter() - seed_started
+
+    results = [None] * args.concurrency
+    issued = itertools.count()
+    started = time.perf_counter()
+    deadline = started + (args.duration if args.requests is None else float('inf'))
+    threads = [threading.Thread(target=run_worker, args=(
+        index, make_client(), generator, args, live_ids, deadline, issued, results))
+        for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    all_latencies, all_statuses, all_sizes = [], Counter(), 0
+    for operation in args.mix:
+        latencies = [value for result in results for value in result[0][operation]]
+        statuses = sum((result[1][operation] for result in results), Counter())
+        sizes = sum(result[2][operation] for result in results)
+        operations[operation] = summarize(latencies, statuses, sizes, elapsed)
+        all_latencies += latencies
+        all_statuses += statuses
+        all_sizes += sizes
+
+    report = {
+        "commit": current_commit(),
+        "target": args.url or f"in-process ({args.store})",
+        "posts": args.posts,
+        "title_size": args.title_size,
+        "content_size": args.content_size,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "seed": args.seed,
+        "seed_seconds": round(seed_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "peak_rss_bytes": peak_rss(args.server_pid) if args.url else peak_rss(),
+        "total": summarize(all_latencies, all_statuses, all_sizes, elapsed),
+        "operations": operations,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
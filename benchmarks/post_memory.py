@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Memory used per post: plain dicts versus the slotted Post model
+
+    python benchmarks/post_memory.py --posts 100000 --content-size 200
+
+Prints a JSON report. The post strings are created before measuring, so
+`record_bytes_per_post` is the cost of the record alone (dict or Post) and
+`store_bytes_per_post` is what PostStore adds on top of the strings,
+including its sorted and search indexes.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from flask import Flask  # noqa: E402
+
+from json_provider import FastJSONProvider  # noqa: E402
+from post import Post  # noqa: E402
+from post_store import PostStore  # noqa: E402
+
+
+def make_fields(count, content_size):
+    return [(post_id, f"Post number {post_id}", (f"Content of post {post_id}. " * content_size)[:content_size])
+            for post_id in range(1, count + 1)]
+
+
+def measure(build):
+    """Bytes allocated by build() that are still alive, and its result"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000, help="number of posts (default 100000)")
+    parser.add_argument('--content-size', type=int, default=200, help="characters of content per post (default 200)")
+    args = parser.parse_args(argv)
+
+    fields = make_fields(args.posts, args.content_size)
+    dict_bytes, dicts = measure(lambda: [{"id": i, "title": t, "content": c} for i, t, c in fields])
+    post_bytes, posts = measure(lambda: [Post(i, t, c) for i, t, c in fields])
+    store_bytes, _ = measure(lambda: PostStore(posts))
+
+    # The JSON sent to clients must not change with the model
+    provider = FastJSONProvider(Flask(__name__))
+    json_unchanged = all(provider.encode(record) == provider.encode(post) for record, post in zip(dicts, posts))
+
+    print(json.dumps({
+        "posts": args.posts,
+        "content_size": args.content_size,
+        "record_bytes_per_post": {
+            "dict": round(dict_bytes / args.posts, 1),
+            "post": round(post_bytes / args.posts, 1),
+        },
+        "store_bytes_per_post": round(store_bytes / args.posts, 1),
+        "json_unchanged": json_unchanged,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 // Function that runs once the window is fully loaded
 window.onload = function() {
+    // Render the posts scrolled into view, whenever the list scrolls or resizes
+    document.getElementById('post-container').addEventListener('scroll', scheduleRender);
+    window.addEventListener('resize', scheduleRender);
+
     // Attempt to retrieve the API base URL from the local storage
     var savedBaseUrl = localStorage.getItem('apiBaseUrl');
     // If a base URL is found in local storage, load the posts
@@ -9,30 +13,257 @@ window.onload = function() {
     }
 }
 
-// Function to fetch all the posts from the API and display them on the page
+// Number of posts requested from the API per page
+var PAGE_SIZE = 100;
+
+// Height of one post in pixels, including the gap below it (see .post in styles.css)
+var ROW_HEIGHT = 160;
+
+// Posts rendered above and below the visible ones, so fast scrolling shows no gaps
+var OVERSCAN = 5;
+
+// Characters of content requested per post; longer content is cut off on screen anyway
+var EXCERPT_LENGTH = 300;
+
+// Incremented on every reload so responses for an older load are ignored
+var loadGeneration = 0;
+
+// API base URL of the current load
+var apiBaseUrl = null;
+
+// The posts loaded so far, in creation (ID) order; only the visible ones have elements
+var posts = [];
+
+// Cursor of the next page, and whether there are more pages to load
+var nextCursor = null;
+var morePages = false;
+
+// Version of the loaded posts, from /posts/changes
+var postsVersion = null;
+
+// The element of each rendered post, by post ID
+var renderedPosts = new Map();
+
+// Whether a page load or a sync is waiting to run, and whether a render is scheduled
+var pageQueued = false;
+var syncQueued = false;
+var renderScheduled = false;
+
+// Page loads and syncs run one at a time, so that a page never overlaps with
+// the changes applied to it
+var pendingRequests = Promise.resolve();
+
+function enqueue(task) {
+    pendingRequests = pendingRequests.then(task)
+        .catch(error => console.error('Error:', error));  // If an error occurs, log it to the console
+}
+
+// Function to load the posts from the API and display them on the page
 function loadPosts() {
     // Retrieve the base URL from the input field and save it to local storage
-    var baseUrl = document.getElementById('api-base-url').value;
-    localStorage.setItem('apiBaseUrl', baseUrl);
-
-    // Use the Fetch API to send a GET request to the /posts endpoint
-    fetch(baseUrl + '/posts')
-        .then(response => response.json())  // Parse the JSON data from the response
-        .then(data => {  // Once the data is ready, we can use it
-            // Clear out the post container first
-            const postContainer = document.getElementById('post-container');
-            postContainer.innerHTML = '';
-
-            // For each post in the response, create a new post element and add it to the page
-            data.forEach(post => {
-                const postDiv = document.createElement('div');
-                postDiv.className = 'post';
-                postDiv.innerHTML = `<h2>${post.title}</h2><p>${post.content}</p>
-                <button onclick="deletePost(${post.id})">Delete</button>`;
-                postContainer.appendChild(postDiv);
+    apiBaseUrl = document.getElementById('api-base-url').value;
+    localStorage.setItem('apiBaseUrl', apiBaseUrl);
+
+    // Forget the posts of the previous load and scroll back to the top
+    loadGeneration++;
+    posts = [];
+    nextCursor = null;
+    morePages = true;
+    postsVersion = null;
+    pageQueued = false;
+    syncQueued = false;
+    renderedPosts.forEach(postDiv => postDiv.remove());
+    renderedPosts.clear();
+    document.getElementById('post-container').scrollTop = 0;
+
+    // Note the current version first, so changes made while the pages load can be applied afterwards
+    var generation = loadGeneration;
+    enqueue(() => fetch(apiBaseUrl + '/posts/changes')
+        .then(response => response.json())
+        .then(feed => {
+            if (generation === loadGeneration) {
+                postsVersion = feed.version;
+            }
+        }));
+
+    // Pages are then fetched as the list is scrolled towards its end
+    scheduleRender();
+}
+
+// Function to fetch the next page of posts, unless it is already on its way
+function loadMore() {
+    if (pageQueued || !morePages) {
+        return;
+    }
+    pageQueued = true;
+
+    var generation = loadGeneration;
+    enqueue(() => {
+        if (generation !== loadGeneration) {
+            return;
+        }
+        var url = apiBaseUrl + '/posts?limit=' + PAGE_SIZE + '&excerpt=' + EXCERPT_LENGTH;
+        if (nextCursor) {
+            url += '&cursor=' + encodeURIComponent(nextCursor);
+        }
+
+        // Use the Fetch API to send a GET request to the /posts endpoint
+        return fetch(url)
+            .then(response => response.json())  // Parse the JSON data from the response
+            .then(page => {  // Once the data is ready, we can use it
+                // Stop if a newer reload has started in the meantime
+                if (generation !== loadGeneration) {
+                    return;
+                }
+
+                // Pages come in ID order, after every post loaded so far
+                page.posts.forEach(post => {
+                    if (posts.length === 0 || post.id > posts[posts.length - 1].id) {
+                        posts.push(post);
+                    }
+                });
+                nextCursor = page.next_cursor;
+                morePages = Boolean(nextCursor);
+                scheduleRender();
+            })
+            .finally(() => {
+                if (generation === loadGeneration) {
+                    pageQueued = false;
+                }
             });
-        })
-        .catch(error => console.error('Error:', error));  // If an error occurs, log it to the console
+    });
+}
+
+// Function to find the position of a post in the loaded posts, or -1
+function findPost(postId) {
+    var low = 0;
+    var high = posts.length - 1;
+    while (low <= high) {
+        var middle = (low + high) >> 1;
+        if (posts[middle].id === postId) {
+            return middle;
+        } else if (posts[middle].id < postId) {
+            low = middle + 1;
+        } else {
+            high = middle - 1;
+        }
+    }
+    return -1;
+}
+
+// Function to apply one change from /posts/changes to the loaded posts
+function applyChange(change) {
+    var index = findPost(change.id);
+    if (change.action === 'delete') {
+        if (index >= 0) {
+            posts.splice(index, 1);
+        }
+    } else if (index >= 0) {
+        posts[index] = change.post;
+    } else if (!morePages) {
+        // New posts have the highest IDs, so they go last. While pages are
+        // still to be loaded, they arrive with the last one instead.
+        posts.push(change.post);
+    }
+}
+
+// Function to fetch the changes made since the posts were loaded and apply them,
+// reloading everything when the API can't tell what changed
+function syncPosts() {
+    if (syncQueued || apiBaseUrl === null) {
+        return;
+    }
+    syncQueued = true;
+
+    var generation = loadGeneration;
+    enqueue(() => {
+        syncQueued = false;
+        if (generation !== loadGeneration || postsVersion === null) {
+            return;
+        }
+        return fetch(apiBaseUrl + '/posts/changes?since=' + encodeURIComponent(postsVersion))
+            .then(response => response.json())
+            .then(feed => {
+                if (generation !== loadGeneration) {
+                    return;
+                }
+                if (feed.resync) {
+                    loadPosts();
+                    return;
+                }
+                feed.changes.forEach(applyChange);
+                postsVersion = feed.version;
+                scheduleRender();
+            });
+    });
+}
+
+// Function to render the visible posts at the next animation frame
+function scheduleRender() {
+    if (!renderScheduled) {
+        renderScheduled = true;
+        requestAnimationFrame(renderPosts);
+    }
+}
+
+// Function to create an empty post element; renderPosts() fills it in
+function createPostElement() {
+    const postDiv = document.createElement('div');
+    postDiv.className = 'post';
+    const deleteButton = document.createElement('button');
+    deleteButton.textContent = 'Delete';
+    deleteButton.onclick = () => deletePost(postDiv.post.id);
+    postDiv.append(document.createElement('h2'), document.createElement('p'), deleteButton);
+    return postDiv;
+}
+
+// Function to render only the posts in view, keeping the elements of posts that stay in view
+function renderPosts() {
+    renderScheduled = false;
+    const postContainer = document.getElementById('post-container');
+    const postList = document.getElementById('post-list');
+
+    // The list is as tall as all loaded posts, so the scrollbar matches them
+    postList.style.height = (posts.length * ROW_HEIGHT) + 'px';
+    const first = Math.max(0, Math.floor(postContainer.scrollTop / ROW_HEIGHT) - OVERSCAN);
+    const last = Math.min(posts.length,
+        Math.ceil((postContainer.scrollTop + postContainer.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+    const visiblePosts = posts.slice(first, last);
+
+    // Elements of posts scrolled out of view are reused for the posts scrolled into view
+    const visibleIds = new Set(visiblePosts.map(post => post.id));
+    const spareElements = [];
+    renderedPosts.forEach((postDiv, postId) => {
+        if (!visibleIds.has(postId)) {
+            spareElements.push(postDiv);
+        }
+    });
+
+    const rendered = new Map();
+    visiblePosts.forEach((post, offset) => {
+        let postDiv = renderedPosts.get(post.id);
+        if (!postDiv) {
+            postDiv = spareElements.pop() || postList.appendChild(createPostElement());
+        }
+        // Only posts that changed are filled in again
+        if (postDiv.post !== post) {
+            postDiv.post = post;
+            postDiv.children[0].textContent = post.title;
+            postDiv.children[1].textContent = post.content;
+        }
+        const top = ((first + offset) * ROW_HEIGHT) + 'px';
+        if (postDiv.style.top !== top) {
+            postDiv.style.top = top;
+        }
+        rendered.set(post.id, postDiv);
+    });
+    spareElements.forEach(postDiv => postDiv.remove());
+    renderedPosts = rendered;
+
+    // Fetch the next page before the user scrolls to the end of the loaded posts
+    if (posts.length - last < PAGE_SIZE / 2) {
+        loadMore();
+    }
 }
 
 // Function to send a POST request to the API to add a new post
@@ -51,7 +282,7 @@ function addPost() {
     .then(response => response.json())  // Parse the JSON data from the response
     .then(post => {
         console.log('Post added:', post);
-        loadPosts(); // Reload the posts after adding a new one
+        syncPosts(); // Show the new post, and apply any other changes
     })
     .catch(error => console.error('Error:', error));  // If an error occurs, log it to the console
 }
@@ -66,7 +297,7 @@ function deletePost(postId) {
     })
     .then(response => {
         console.log('Post deleted:', postId);
-        loadPosts(); // Reload the posts after deleting one
+        syncPosts(); // Remove the post, and apply any other changes
     })
     .catch(error => console.error('Error:', error));  // If an error occurs, log it to the console
 }
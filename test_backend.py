@@ -0,0 +1,855 @@
+#!/usr/bin/env python3
+"""
+In-process tests for the Blog API using the Flask test client
+"""
+import datetime
+import gzip
+import json
+import marshal
+import os
+import queue
+import threading
+import time
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import asyncio  # noqa: E402
+from urllib.parse import quote, urlsplit  # noqa: E402
+
+import flask  # noqa: E402
+
+import backend_app  # noqa: E402
+import event_stream  # noqa: E402
+import serve  # noqa: E402
+from asgi_app import AsgiApp  # noqa: E402
+from change_log import ChangeLog  # noqa: E402
+from event_stream import EventHub  # noqa: E402
+from json_provider import EncodedPostCache, FastJSONProvider  # noqa: E402
+from post import Post  # noqa: E402
+from response_cache import LocalCacheBackend, RedisCacheBackend, ResponseCache  # noqa: E402
+from storage import open_store  # noqa: E402
+
+
+SEED_POSTS = [
+    {"id": 1, "title": "First post", "content": "This is the first post."},
+    {"id": 2, "title": "Second post", "content": "This is the second post."},
+]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    """A fresh post store of each kind, seeded with two posts"""
+    url = 'memory' if request.param == 'memory' else f"sqlite:///{tmp_path / 'blog.db'}"
+    store = open_store(url, SEED_POSTS)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def cache(request):
+    """A fresh response cache (in-process unless parametrized with 'shared')"""
+    if getattr(request, 'param', 'local') == 'shared':
+        return ResponseCache(RedisCacheBackend(FakeRedis()))
+    return ResponseCache(LocalCacheBackend())
+
+
+class AsgiTestClient:
+    """Sends requests through the ASGI app, with the Flask test client's interface"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def open(self, url, method='GET', json=None, headers=None):
+        parts = urlsplit(url)
+        body = b'' if json is None else flask.json.dumps(json).encode('utf-8')
+        header_list = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                       for name, value in (headers or {}).items()]
+        if json is not None:
+            header_list.append((b'content-type', b'application/json'))
+        scope = {
+            'type': 'http', 'method': method, 'path': parts.path, 'query_string': parts.query.encode('latin-1'),
+            'headers': header_list, 'server': ('localhost', 5002), 'client': ('127.0.0.1', 50000),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        start = sent[0]
+        response_body = b''.join(message.get('body', b'') for message in sent[1:])
+        return flask.Response(response_body, status=start['status'],
+                              headers=[(name.decode('latin-1'), value.decode('latin-1'))
+                                       for name, value in start['headers']])
+
+    def get(self, url, **kwargs):
+        return self.open(url, 'GET', **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.open(url, 'POST', **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.open(url, 'PUT', **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.open(url, 'DELETE', **kwargs)
+
+
+@pytest.fixture(params=['wsgi', 'asgi'])
+def client(request, monkeypatch, store, cache):
+    """Test client backed by a fresh post store and response cache, for each serving mode"""
+    encoded_posts = EncodedPostCache(backend_app.app.json.encode)
+    changes = ChangeLog(store.version()[1], capacity=5)
+    events = EventHub(store.version()[0], backend_app.app.json.encode)
+    store.add_listener(cache.post_written)
+    store.add_listener(encoded_posts.post_written)
+    store.add_listener(changes.post_written)
+    store.add_listener(events.post_written)
+    monkeypatch.setattr(backend_app, 'POSTS', store)
+    monkeypatch.setattr(backend_app, 'RESPONSE_CACHE', cache)
+    monkeypatch.setattr(backend_app, 'ENCODED_POSTS', encoded_posts)
+    monkeypatch.setattr(backend_app, 'CHANGES', changes)
+    monkeypatch.setattr(backend_app, 'EVENTS', events)
+    if request.param == 'wsgi':
+        yield backend_app.app.test_client()
+        return
+    asgi_app = AsgiApp(backend_app.app, threads=4)
+    yield AsgiTestClient(asgi_app)
+    asgi_app.executor.shutdown()
+
+
+def new_client(client):
+    """A client of the same kind for use on another thread"""
+    if isinstance(client, AsgiTestClient):
+        return client
+    return backend_app.app.test_client()
+
+
+def test_store_lookup_update_delete(store):
+    """The store finds, updates and deletes posts by ID and keeps creation order"""
+    store.add(Post(3, "Third", "Third content"))
+
+    assert store.get(2)['title'] == "Second post"
+    assert store.update(2, title="Changed")['title'] == "Changed"
+    assert store.update(99, title="Nope") is None
+    assert store.delete(1)['id'] == 1
+    assert store.delete(1) is None
+    assert [post['id'] for post in store.all()] == [2, 3]
+
+
+def test_sqlite_store_survives_reopen(tmp_path):
+    """Posts and the ID counter persist across restarts of the SQLite store"""
+    url = f"sqlite:///{tmp_path / 'blog.db'}"
+    store = open_store(url, SEED_POSTS)
+    new_id = store.create("Third", "Third content")['id']
+    store.delete(new_id)
+    store.close()
+
+    store = open_store(url, SEED_POSTS)
+    assert [post['id'] for post in store.all()] == [1, 2]
+    assert store.create("Fourth", "Fourth content")['id'] == new_id + 1
+    store.close()
+
+
+def test_multi_worker_launcher_requires_shared_store(tmp_path):
+    """Worker processes only start on a store they all share, and see each other's writes"""
+    with pytest.raises(SystemExit):
+        serve.parse_args(['--workers', '2', '--store', 'memory'])
+    url = f"sqlite:///{tmp_path / 'blog.db'}"
+    assert serve.parse_args(['--workers', '2', '--store', url]).workers == 2
+
+    first, second = open_store(url, SEED_POSTS), open_store(url, SEED_POSTS)
+    second.after_fork()
+    post = first.create("Written by one worker", "Content")
+    assert second.get(post['id']) == post
+    assert second.version()[1] == first.version()[1]
+    first.close()
+    second.close()
+
+
+def test_crud_roundtrip(client):
+    """Create, update and delete keep GET /api/posts in creation order"""
+    response = client.post('/api/posts', json={"title": "Third", "content": "Third content"})
+    assert response.status_code == 201
+    new_id = response.get_json()['id']
+
+    response = client.put(f'/api/posts/{new_id}', json={"title": "Third (edited)"})
+    assert response.status_code == 200
+    assert response.get_json() == {"id": new_id, "title": "Third (edited)", "content": "Third content"}
+
+    assert client.delete('/api/posts/1').status_code == 200
+    assert client.delete('/api/posts/1').status_code == 404
+    assert client.put('/api/posts/1', json={"title": "x"}).status_code == 404
+
+    ids = [post['id'] for post in client.get('/api/posts').get_json()]
+    assert ids == [2, new_id]
+
+
+def test_ids_are_not_reused_after_delete(client):
+    """New posts get fresh IDs even when the newest post was deleted"""
+    new_id = client.post('/api/posts', json={"title": "Third", "content": "c"}).get_json()['id']
+    assert new_id == 3
+    client.delete(f'/api/posts/{new_id}')
+
+    next_id = client.post('/api/posts', json={"title": "Fourth", "content": "c"}).get_json()['id']
+    assert next_id == 4
+
+
+def test_non_string_fields_are_rejected(client, store):
+    """Writes with non-text fields get a 400 and leave the store untouched"""
+    assert client.post('/api/posts', json={"title": 5, "content": "c"}).status_code == 400
+    assert client.put('/api/posts/1', json={"title": 5}).status_code == 400
+    assert client.put('/api/posts/1', json={"content": ["x"]}).status_code == 400
+    with pytest.raises(TypeError):
+        store.update(1, title=5)
+    with pytest.raises(TypeError):
+        store.create("Title", {"not": "text"})
+
+    assert client.get('/api/posts/1').get_json()['title'] == "First post"
+    assert [post['id'] for post in client.get('/api/posts/search?title=first').get_json()] == [1]
+    assert client.delete('/api/posts/1').status_code == 200
+    assert client.post('/api/posts', json={"title": "Third", "content": "c"}).get_json()['id'] == 3
+
+
+def test_sorted_index_matches_stable_sort(client):
+    """Sorted reads match a stable case-insensitive sort in both directions"""
+    for title in ["banana", "Apple", "cherry", "apple", "Banana"]:
+        client.post('/api/posts', json={"title": title, "content": title[::-1]})
+    client.put('/api/posts/3', json={"title": "zebra"})
+    client.delete('/api/posts/4')
+
+    expected = client.get('/api/posts').get_json()
+    for field in ['title', 'content']:
+        for direction in ['asc', 'desc']:
+            response = client.get(f'/api/posts?sort={field}&direction={direction}')
+            assert response.get_json() == sorted(
+                expected, key=lambda post: post[field].casefold(), reverse=(direction == 'desc'))
+
+
+def test_casefolded_fields_are_kept_in_sync(client):
+    """Sorting and search use the casefolded fields stored at write time, also after updates"""
+    client.post('/api/posts', json={"title": "Straße", "content": "ΣΊΣΥΦΟΣ"})
+    client.put('/api/posts/1', json={"title": "STRASSE nord"})
+    client.put('/api/posts/2', json={"title": "Ägypten"})
+
+    def search(field, query):
+        return [post['id'] for post in client.get(f'/api/posts/search?{field}={quote(query)}').get_json()]
+    assert search('title', "strasse") == [1, 3]
+    assert search('content', "σίσυφος") == [3]
+    assert search('title', "second") == []
+    sorted_titles = [post['title'] for post in client.get('/api/posts?sort=title').get_json()]
+    assert sorted_titles == ["Straße", "STRASSE nord", "Ägypten"]
+
+
+def test_search_modes(client):
+    """Substring search keeps its old semantics; term modes match whole words"""
+    client.post('/api/posts', json={"title": "Flask Tutorial", "content": "Routing in Flask apps"})
+    client.post('/api/posts', json={"title": "Python Guide", "content": "Tutorials for Python"})
+
+    def search(query):
+        response = client.get('/api/posts/search?' + query)
+        assert response.status_code == 200
+        return [post['id'] for post in response.get_json()]
+
+    assert search('title=POST') == [1, 2]
+    assert search('title=st p') == [1]
+    assert search('content=tutorial') == [4]
+    assert search('title=flask&content=python') == [3, 4]
+    assert search('content=tutorial&mode=all') == []
+    assert search('content=tutorial*&mode=all') == [4]
+    assert search('content=flask routing&mode=all') == [3]
+    assert search('content=flask python&mode=any') == [3, 4]
+    assert search('title=missing') == []
+
+    client.put('/api/posts/3', json={"title": "Django Tutorial"})
+    assert search('title=flask') == []
+    client.delete('/api/posts/4')
+    assert search('content=python') == []
+
+    assert client.get('/api/posts/search?title=x&mode=fuzzy').status_code == 400
+
+
+def collect_pages(client, url):
+    """Follow next_cursor links and return every post seen, page by page"""
+    posts, cursor = [], None
+    while True:
+        separator = '&' if '?' in url else '?'
+        page_url = url + separator + 'limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(page_url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['posts']) <= 2
+        posts.extend(page['posts'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return posts
+
+
+def test_cursor_pagination_matches_full_listing(client):
+    """Paging through every sort order yields the same posts as the full listing"""
+    for title in ["b", "A", "c", "a", "B", "b"]:
+        client.post('/api/posts', json={"title": title, "content": f"post {title}"})
+
+    for query in ['', 'sort=title', 'sort=title&direction=desc', 'sort=content&direction=desc']:
+        full = client.get('/api/posts?' + query).get_json()
+        assert collect_pages(client, '/api/posts?' + query) == full
+
+    full = client.get('/api/posts/search?content=post').get_json()
+    assert collect_pages(client, '/api/posts/search?content=post') == full
+
+
+def test_pagination_validation(client):
+    """Bad limits and cursors from another sort order are rejected"""
+    assert client.get('/api/posts?limit=0').status_code == 400
+    assert client.get('/api/posts?limit=abc').status_code == 400
+    assert client.get('/api/posts?limit=1&cursor=garbage').status_code == 400
+
+    cursor = client.get('/api/posts?limit=1').get_json()['next_cursor']
+    assert client.get(f'/api/posts?sort=title&limit=1&cursor={cursor}').status_code == 400
+
+
+def test_streamed_listing_matches_json_listing(client, monkeypatch):
+    """Streamed JSON and NDJSON listings contain the same posts as the regular one"""
+    monkeypatch.setattr(backend_app, 'STREAM_BATCH_SIZE', 2)
+    for title in ["b", "A", "c"]:
+        client.post('/api/posts', json={"title": title, "content": title})
+
+    for query in ['', '&sort=title&direction=desc']:
+        full = client.get('/api/posts?' + query).get_json()
+
+        response = client.get('/api/posts?stream=1' + query)
+        assert response.is_streamed or isinstance(client, AsgiTestClient)
+        assert response.get_json() == full
+
+        response = client.get('/api/posts?x=1' + query, headers={'Accept': 'application/x-ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line) for line in lines] == full
+
+
+def test_journaled_store_replays_after_restart(tmp_path):
+    """Writes survive a restart, with and without a snapshot in between"""
+    url = f"memory:///{tmp_path / 'blog.log'}?fsync=0&snapshot_every=3"
+    store = open_store(url, SEED_POSTS)
+    store.create("Third", "Third content")
+    store.update(1, title="First (edited)")
+    store.delete(2)
+    store.create("Fourth", "Fourth content")
+    store.delete(4)
+    store.close()
+
+    store = open_store(url, SEED_POSTS)
+    assert store.all() == [
+        Post(1, "First (edited)", "This is the first post."),
+        Post(3, "Third", "Third content"),
+    ]
+    assert store.sorted('title', descending=True)[0]['id'] == 3
+    assert store.create("Fifth", "Fifth content")['id'] == 5
+    store.snapshot()
+    store.close()
+
+    store = open_store(url, SEED_POSTS)
+    assert [post['id'] for post in store.all()] == [1, 3, 5]
+    store.close()
+
+
+def test_bulk_endpoints(client, store):
+    """Bulk create, update and delete apply whole batches and report per item"""
+    response = client.post('/api/posts/bulk', json={"posts": [
+        {"title": "Bulk A", "content": "a"}, {"title": "Bulk B", "content": "b"}]})
+    assert response.status_code == 201
+    assert [result['post']['id'] for result in response.get_json()['results']] == [3, 4]
+
+    response = client.post('/api/posts/bulk', json=[{"title": "ok", "content": "ok"}, {"title": "no content"}])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{"index": 1, "error": "Missing required fields: content"}]
+    assert len(client.get('/api/posts').get_json()) == 4
+
+    response = client.post('/api/posts/bulk', json=[{"title": "a", "content": "b"}, {"title": ["x"], "content": "c"}])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{"index": 1, "error": "Fields must be strings: title"}]
+    with pytest.raises(TypeError):
+        store.create_many([{"title": "a", "content": "b"}, {"title": ["x"], "content": "c"}])
+    assert len(client.get('/api/posts').get_json()) == 4
+
+    response = client.put('/api/posts/bulk', json=[{"id": 3, "title": "Bulk A2"}, {"id": 99, "title": "x"}])
+    assert [result['status'] for result in response.get_json()['results']] == [200, 404]
+    assert client.put('/api/posts/bulk', json=[{"title": "no id"}]).status_code == 400
+    assert client.put('/api/posts/bulk', json=[{"id": 4, "title": "B2"}, {"id": 1, "title": 7}]).status_code == 400
+    with pytest.raises(TypeError):
+        store.update_many([{"id": 4, "title": "B2"}, {"id": 1, "title": 7}])
+    assert client.get('/api/posts/4').get_json()['title'] == "Bulk B"
+
+    response = client.delete('/api/posts/bulk', json={"ids": [1, 4, 99]})
+    assert [result['status'] for result in response.get_json()['results']] == [200, 200, 404]
+    assert client.get('/api/posts').get_json() == [
+        {"id": 2, "title": "Second post", "content": "This is the second post."},
+        {"id": 3, "title": "Bulk A2", "content": "a"},
+    ]
+    assert client.get('/api/posts/search?title=bulk').get_json()[0]['id'] == 3
+
+
+def test_concurrent_requests_stress(client):
+    """All five endpoints hammered from many threads keep the store consistent"""
+    thread_count, rounds = 8, 40
+    created_ids = [[] for _ in range(thread_count)]
+    failures = []
+    start = threading.Barrier(thread_count)
+
+    def worker(number):
+        worker_client = new_client(client)
+        start.wait()
+        for i in range(rounds):
+            title = f"T{number}-{i}"
+            response = worker_client.post('/api/posts', json={"title": title, "content": f"body {title}"})
+            if response.status_code != 201:
+                failures.append(('create', response.status_code))
+                continue
+            post = response.get_json()
+            created_ids[number].append(post['id'])
+
+            response = worker_client.put(f"/api/posts/{post['id']}", json={"title": title + "x", "content": "new"})
+            updated = response.get_json()
+            if response.status_code != 200 or updated != {"id": post['id'], "title": title + "x", "content": "new"}:
+                failures.append(('update', response.status_code))
+
+            for url in ['/api/posts', '/api/posts?sort=title&direction=desc', f'/api/posts/search?title={title}x']:
+                response = worker_client.get(url)
+                posts = response.get_json()
+                if response.status_code != 200 or not all(p['title'] != title for p in posts if p['id'] == post['id']):
+                    failures.append(('read', url, response.status_code))
+
+            if i % 2:
+                if worker_client.delete(f"/api/posts/{post['id']}").status_code != 200:
+                    failures.append(('delete', post['id']))
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+    all_ids = [post_id for ids in created_ids for post_id in ids]
+    assert len(all_ids) == len(set(all_ids)) == thread_count * rounds
+
+    posts = client.get('/api/posts').get_json()
+    assert len(posts) == 2 + thread_count * rounds // 2
+    assert sorted(client.get('/api/posts?sort=title').get_json(), key=lambda post: post['id']) == posts
+    assert len(client.get('/api/posts/search?content=new').get_json()) == len(posts) - 2
+
+
+def test_conditional_get(client):
+    """Listings answer 304 until a write bumps the store version"""
+    response = client.get('/api/posts')
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert 'Last-Modified' in response.headers
+
+    response = client.get('/api/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    response = client.get('/api/posts/search?title=post', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.put('/api/posts/1', json={"title": "Changed"})
+    response = client.get('/api/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    last_modified = response.headers['Last-Modified']
+    response = client.get('/api/posts', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+
+class FakeRedis:
+    """The few Redis commands RedisCacheBackend uses, kept in a dict"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None):
+        self.data[name] = value
+
+    def delete(self, *names):
+        for name in names:
+            self.data.pop(name, None)
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[key.encode('utf-8')] = value.encode('utf-8')
+
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.data.get(name, {}).pop(key.encode('utf-8'), None)
+
+
+@pytest.mark.parametrize('cache', ['local', 'shared'], indirect=True)
+def test_response_cache_invalidation(client, cache):
+    """Cached responses are reused until a write touches the data they depend on"""
+    client.post('/api/posts', json={"title": "Zebra facts", "content": "Stripes"})
+
+    def cached_get(url):
+        hits = cache.hits
+        body = client.get(url).get_json()
+        return body, cache.hits > hits
+
+    assert cached_get('/api/posts/search?title=zebra') == ([{"id": 3, "title": "Zebra facts", "content": "Stripes"}], False)
+    assert cached_get('/api/posts/search?title=zebra')[1]
+    assert not cached_get('/api/posts?sort=title')[1]
+    assert cached_get('/api/posts?sort=title')[1]
+
+    # An unrelated write drops listings but not the zebra search
+    client.post('/api/posts', json={"title": "Lions", "content": "Manes"})
+    assert not cached_get('/api/posts?sort=title')[1]
+    assert cached_get('/api/posts/search?title=zebra')[1]
+
+    # Renaming a post into the results drops the search
+    client.put('/api/posts/4', json={"title": "Zebra crossing"})
+    body, hit = cached_get('/api/posts/search?title=zebra')
+    assert not hit and [post['id'] for post in body] == [3, 4]
+
+    stats = client.get('/api/cache/stats').get_json()
+    assert stats['invalidations'] > 0 and stats['hits'] == cache.hits
+
+
+def test_local_cache_evicts_by_size():
+    """The in-process cache evicts least recently used bodies past its byte limit"""
+    backend = LocalCacheBackend(max_bytes=10)
+    backend.set('a', b'12345', None)
+    backend.set('b', b'12345', None)
+    backend.get('a')
+    backend.set('c', b'12345', None)
+    assert backend.get('b') is None and backend.get('a') == b'12345'
+    assert backend.evictions == 1
+    assert backend.size() == (2, 10)
+
+
+def test_fast_json_provider_matches_default_provider():
+    """orjson output is byte for byte what the standard library provider writes"""
+    fast, standard = backend_app.app.json, FastJSONProvider(backend_app.app, use_orjson=False)
+    values = [
+        {"title": "Caf\u00e9", "id": 3, "content": "a \"quoted\"\nline"},
+        {"posts": SEED_POSTS, "next_cursor": None},
+        {"date": datetime.date(2024, 1, 2), "big": 2 ** 70, "float": 1.5},
+    ]
+    for value in values:
+        assert fast.loads(fast.encode(value)) == standard.loads(standard.encode(value))
+        assert fast.dumps(value, indent=2) == standard.dumps(value, indent=2, ensure_ascii=False)
+    assert fast.encode(SEED_POSTS) == standard.encode(SEED_POSTS)
+    assert fast.loads(b'[1, NaN]')[0] == 1
+
+
+def test_encoded_post_cache_follows_writes(client):
+    """Listings reuse encoded posts but never an encoding of an older version"""
+    encoded_posts = backend_app.ENCODED_POSTS
+    assert [post['id'] for post in client.get('/api/posts').get_json()] == [1, 2]
+    assert encoded_posts.size()[0] == 2
+    client.put('/api/posts/1', json={"title": "Renamed"})
+    assert encoded_posts.size()[0] == 1
+    assert client.get('/api/posts').get_json()[0]['title'] == "Renamed"
+    assert client.get('/api/posts?stream=1').get_json()[0]['title'] == "Renamed"
+
+    stale = Post(2, "Old", "Old")
+    assert b'"Old"' in encoded_posts.get(stale)
+    assert b'"Second post"' in encoded_posts.get(backend_app.POSTS.get(2))
+
+
+def test_metrics_endpoint(client, store):
+    """/metrics reports per-route requests, latency, sizes and phases in Prometheus format"""
+    client.get('/api/posts')
+    client.get('/api/posts/search?title=first')
+    client.post('/api/posts', json={"title": "Third", "content": "Third content"})
+    client.delete('/api/posts/99')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    lines = response.get_data(as_text=True).splitlines()
+    samples = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+
+    def sample(name):
+        return float(samples[name])
+    assert sample('blog_http_requests_total{method="POST",route="/api/posts",status="201"}') >= 1
+    assert sample('blog_http_requests_total{method="DELETE",route="/api/posts/<int:post_id>",status="404"}') >= 1
+    assert sample('blog_http_request_duration_seconds_count{method="GET",route="/api/posts"}') >= 1
+    assert sample('blog_http_request_duration_seconds_bucket{method="GET",route="/api/posts",le="+Inf"}') >= 1
+    assert sample('blog_http_response_size_bytes_sum{method="GET",route="/api/posts"}') > 0
+    for phase in ['validation', 'cache', 'search', 'serialization']:
+        assert sample(f'blog_http_request_phase_seconds_count{{route="/api/posts/search",phase="{phase}"}}') >= 1
+    assert sample('blog_http_request_phase_seconds_count{route="/api/posts",phase="store"}') >= 1
+    assert sample('blog_posts') == 3
+    assert sample('blog_response_cache_requests_total{result="miss"}') >= 2
+    if store.lock_wait_stats() is not None:
+        assert sample('blog_store_lock_waits_total{mode="write"}') >= 0
+
+
+def test_profiling_endpoints(client, monkeypatch):
+    """Profiling is off by default, needs the admin token, and profiles the next requests to a route"""
+    assert client.post('/api/admin/profile/sample?seconds=0.1').status_code == 404
+    monkeypatch.setattr(backend_app, 'PROFILING_TOKEN', 'secret')
+    assert client.post('/api/admin/profile/sample?seconds=0.1').status_code == 401
+    auth = {'Authorization': 'Bearer secret'}
+
+    response = client.post('/api/admin/profile/sample?seconds=0.1&interval=0.01', headers=auth)
+    assert response.status_code == 200
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in response.get_data(as_text=True).splitlines())
+    assert client.post('/api/admin/profile/sample?seconds=999', headers=auth).status_code == 400
+    assert client.post('/api/admin/profile/requests?route=/nope', headers=auth).status_code == 400
+
+    results = {}
+
+    def take_profile():
+        results['response'] = new_client(client).post(
+            '/api/admin/profile/requests?route=/api/posts/search&count=2&timeout=10', headers=auth)
+    profiler = threading.Thread(target=take_profile)
+    profiler.start()
+    while backend_app.PROFILER._session is None:
+        time.sleep(0.001)
+    for _ in range(3):
+        client.get('/api/posts/search?title=first')
+    profiler.join()
+
+    response = results['response']
+    assert response.status_code == 200
+    assert response.headers['X-Profiled-Requests'] == '2'
+    stats = marshal.loads(response.get_data())
+    assert any(function == 'search_posts' for _, _, function in stats)
+
+
+def test_single_post_and_field_projection(client):
+    """GET /api/posts/<id> reads one post; fields= and excerpt= narrow listings and searches"""
+    long_content = "word " * 100
+    client.post('/api/posts', json={"title": "Long post", "content": long_content})
+
+    assert client.get('/api/posts/3').get_json() == {"id": 3, "title": "Long post", "content": long_content}
+    response = client.get('/api/posts/99')
+    assert response.status_code == 404 and response.get_json()['error'] == "Post with id 99 not found."
+    etag = client.get('/api/posts/1').headers['ETag']
+    assert client.get('/api/posts/1', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/posts/1?fields=title').get_json() == {"title": "First post"}
+
+    assert client.get('/api/posts?fields=id,title').get_json() == [
+        {"id": 1, "title": "First post"}, {"id": 2, "title": "Second post"}, {"id": 3, "title": "Long post"}]
+    excerpt = client.get('/api/posts?sort=title&direction=asc&fields=id,content&excerpt=12').get_json()
+    assert excerpt[1] == {"id": 3, "content": "word word wo…"}
+    assert excerpt[0] == {"id": 1, "content": "This is the…"}
+    page = client.get('/api/posts?limit=2&fields=id').get_json()
+    assert page['posts'] == [{"id": 1}, {"id": 2}] and page['next_cursor']
+    assert client.get('/api/posts?fields=id&stream=1').get_json() == [{"id": 1}, {"id": 2}, {"id": 3}]
+    assert client.get('/api/posts/search?content=word&fields=title').get_json() == [{"title": "Long post"}]
+    assert client.get('/api/posts/search?content=word&limit=5&excerpt=4').get_json()['posts'] == [
+        {"id": 3, "title": "Long post", "content": "word…"}]
+
+    # Projected responses are cached separately from whole posts
+    assert len(client.get('/api/posts').get_json()[2]['content']) == len(long_content)
+
+    for query in ['fields=', 'fields=id,author', 'excerpt=0', 'excerpt=-5', 'excerpt=ten']:
+        response = client.get('/api/posts?' + query)
+        assert response.status_code == 400, query
+        assert 'error' in response.get_json()
+    assert client.get('/api/posts/search?title=first&fields=nope').status_code == 400
+
+
+def test_response_compression(client, monkeypatch):
+    """Bodies are gzipped for clients that accept it, above a size threshold, streamed or cached"""
+    monkeypatch.setattr(backend_app.COMPRESSION, 'levels', {'gzip': 6})
+    monkeypatch.setattr(backend_app.COMPRESSION, 'min_bytes', 500)
+    gzip_headers = {'Accept-Encoding': 'br;q=1.0, gzip;q=0.8'}
+
+    # Below the threshold, or without Accept-Encoding, bodies are sent as they are
+    response = client.get('/api/posts', headers=gzip_headers)
+    assert 'Content-Encoding' not in response.headers and 'Accept-Encoding' in response.headers['Vary']
+    assert response.get_json()[0]['title'] == "First post"
+
+    client.post('/api/posts/bulk', json=[{"title": f"Post {i}", "content": "text " * 20} for i in range(20)])
+    plain = client.get('/api/posts')
+    assert 'Content-Encoding' not in plain.headers
+    for _ in range(2):  # compressed once, then served from the response cache
+        response = client.get('/api/posts', headers=gzip_headers)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()) == plain.get_data()
+    assert client.get('/api/posts', headers={'Accept-Encoding': 'gzip;q=0'}).get_data() == plain.get_data()
+
+    # A write invalidates the compressed copy along with the plain one
+    client.delete('/api/posts/1')
+    response = client.get('/api/posts', headers=gzip_headers)
+    assert json.loads(gzip.decompress(response.get_data()))[0]['id'] == 2
+
+    # Streams are compressed as they are sent, whatever their size
+    response = client.get('/api/posts?fields=id&stream=1', headers=gzip_headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.is_streamed or isinstance(client, AsgiTestClient)
+    assert [post['id'] for post in json.loads(gzip.decompress(response.get_data()))] == list(range(2, 23))
+
+    # Errors are left alone
+    response = client.get('/api/posts?sort=nope', headers=gzip_headers)
+    assert response.status_code == 400 and 'Content-Encoding' not in response.headers
+
+
+def test_change_feed(client, store):
+    """/api/posts/changes replays the writes since a version, or asks for a reload when it can't"""
+    start = client.get('/api/posts/changes').get_json()
+    assert start['resync'] and start['changes'] == []
+
+    client.post('/api/posts', json={"title": "Third", "content": "3"})
+    client.put('/api/posts/1', json={"title": "First, edited"})
+    client.delete('/api/posts/2')
+    feed = client.get('/api/posts/changes?since=' + start['version']).get_json()
+    assert not feed['resync']
+    assert feed['changes'] == [
+        {"action": "create", "id": 3, "post": {"id": 3, "title": "Third", "content": "3"}},
+        {"action": "update", "id": 1, "post": {"id": 1, "title": "First, edited", "content": "This is the first post."}},
+        {"action": "delete", "id": 2, "post": None},
+    ]
+    assert client.get('/api/posts/changes?since=' + feed['version']).get_json() == {
+        "version": feed['version'], "resync": False, "changes": []}
+
+    # Clients further behind than the log reaches (5 writes here) have to reload
+    for i in range(3):
+        client.put('/api/posts/3', json={"content": str(i)})
+    assert client.get('/api/posts/changes?since=' + start['version']).get_json()['resync']
+    assert len(client.get('/api/posts/changes?since=' + feed['version']).get_json()['changes']) == 3
+
+    # So do clients of another data set, and clients that missed writes made elsewhere
+    generation, version, _ = store.version()
+    assert client.get(f"/api/posts/changes?since=other-{version}").get_json()['resync']
+    backend_app.CHANGES.post_written(version + 2, None, Post(9, "Elsewhere", ""))
+    assert client.get(f"/api/posts/changes?since={generation}-{version}").get_json()['resync']
+
+    for since in ['42', 'abc-', 'abc-x']:
+        response = client.get('/api/posts/changes?since=' + since)
+        assert response.status_code == 400 and 'error' in response.get_json()
+
+
+class EventStreamReader:
+    """An open /api/posts/stream response, read chunk by chunk, for either kind of client"""
+
+    def __init__(self, client, headers=None):
+        if isinstance(client, AsgiTestClient):
+            self.messages = queue.Queue()
+            self.loop = asyncio.new_event_loop()
+            self.disconnect = asyncio.Event()
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': '/api/posts/stream', 'query_string': b'',
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in (headers or {}).items()],
+            }
+            self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(client.app, scope),),
+                                           daemon=True)
+            self.thread.start()
+            start = self.messages.get(timeout=5)
+            self.status = start['status']
+            self.headers = flask.Response(headers=[(name.decode('latin-1'), value.decode('latin-1'))
+                                                   for name, value in start['headers']]).headers
+        else:
+            self.response = client.get('/api/posts/stream', headers=headers, buffered=False)
+            self.status = self.response.status_code
+            self.headers = self.response.headers
+            self.chunks = iter(self.response.response)
+
+    async def run(self, app, scope):
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await self.disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            self.messages.put(message)
+
+        await app(scope, receive, send)
+
+    def next(self):
+        if hasattr(self, 'chunks'):
+            return next(self.chunks, b'')
+        return self.messages.get(timeout=5).get('body', b'')
+
+    def close(self):
+        if hasattr(self, 'chunks'):
+            self.response.close()
+        else:
+            self.loop.call_soon_threadsafe(self.disconnect.set)
+            self.thread.join(5)
+            self.loop.close()
+
+
+def parse_events(data):
+    """Server-sent events as dicts of their fields, with `data` decoded from JSON"""
+    events = []
+    for block in data.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if 'data' in fields:
+            fields['data'] = json.loads(fields['data'])
+            events.append(fields)
+    return events
+
+
+def test_event_stream(client, store, monkeypatch):
+    """/api/posts/stream pushes every write and resumes after Last-Event-ID"""
+    monkeypatch.setattr(event_stream, 'HEARTBEAT_SECONDS', 0.05)
+    generation, start_version, _ = store.version()
+
+    stream = EventStreamReader(client)
+    assert stream.status == 200 and stream.headers['Content-Type'].startswith('text/event-stream')
+    assert stream.next() == b'retry: 3000\n\n'
+    client.post('/api/posts', json={"title": "Live", "content": "pushed"})
+    assert parse_events(stream.next()) == [{
+        "id": f"{generation}-{start_version + 1}", "event": "create",
+        "data": {"action": "create", "id": 3, "post": {"id": 3, "title": "Live", "content": "pushed"}}}]
+    assert stream.next() == event_stream.HEARTBEAT
+    stream.close()
+    deadline = time.monotonic() + 5
+    while len(backend_app.EVENTS) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(backend_app.EVENTS) == 0
+
+    # Reconnecting clients get the events they missed first
+    client.put('/api/posts/3', json={"title": "Edited"})
+    client.delete('/api/posts/1')
+    stream = EventStreamReader(client, {'Last-Event-ID': f"{generation}-{start_version + 1}"})
+    assert [(event['event'], event['data']['id']) for event in parse_events(stream.next())] == [
+        ('update', 3), ('delete', 1)]
+    client.delete('/api/posts/2')
+    assert [event['id'] for event in parse_events(stream.next())] == [f"{generation}-{start_version + 4}"]
+    stream.close()
+
+    # ...or are told to reload when the events are not known
+    for last_event_id in ['other-1', f"{generation}-{start_version - 1}", 'nonsense']:
+        stream = EventStreamReader(client, {'Last-Event-ID': last_event_id})
+        assert parse_events(stream.next())[0]['event'] == 'resync'
+        stream.close()
+
+
+def test_event_hub_evicts_slow_subscribers():
+    """A subscriber with a full queue is dropped instead of buffering without bound"""
+    hub = EventHub('g', backend_app.app.json.encode, max_events=2, max_subscribers=2)
+    woken = []
+    slow = hub.subscribe(lambda: woken.append('slow'))
+    fast = hub.subscribe(lambda: woken.append('fast'))
+    with pytest.raises(event_stream.EventStreamFull):
+        hub.subscribe(lambda: None)
+
+    for version in range(1, 4):
+        hub.post_written(version, None, Post(version, "Title", "Content"))
+        assert len(fast.drain()) == 1
+    assert slow.evicted and not fast.evicted
+    assert len(hub) == 1 and hub.evictions == 1
+    assert [event.split(b'\n')[0] for event in slow.drain()] == [b'id: g-1', b'id: g-2']
+    assert woken.count('slow') == 3 and woken.count('fast') == 3